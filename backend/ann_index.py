@@ -0,0 +1,218 @@
+# ann_index.py
+
+import os
+import json
+import time
+import numpy as np
+from dotenv import load_dotenv
+
+import docstore
+
+load_dotenv()
+
+# ============================
+#  LOCAL QUANTIZED ANN INDEX
+# ============================
+# IVF coarse partitioning + int8 residual codes, memory-mapped at query
+# time. Candidates from the probed lists are re-scored exactly against
+# the float32 vectors, which stay on disk and are only paged in for the
+# shortlist. Resident memory is the int8 codes (4x below float32).
+#
+# Knobs (recall vs latency):
+#   ANN_NPROBE  - number of coarse lists scanned per query. Query time is
+#                 dominated by the int8 -> float32 scan of the probed lists,
+#                 so it grows linearly with nprobe (`python ann_index.py`)
+#   ANN_RERANK  - shortlist size as a multiple of top_k for exact re-scoring
+
+ANN_INDEX_DIR = os.getenv("ANN_INDEX_DIR", "ann_index")
+ANN_NPROBE = int(os.getenv("ANN_NPROBE", "4"))
+ANN_RERANK = int(os.getenv("ANN_RERANK", "4"))
+
+KMEANS_ITERATIONS = 10
+KMEANS_MAX_TRAIN = 50000
+
+
+def _normalize(x):
+    x = np.asarray(x, dtype=np.float32)
+    norms = np.linalg.norm(x, axis=-1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return x / norms
+
+
+def _assign(vectors, centroids, batch_size=8192):
+    """Nearest centroid (by inner product) for each vector."""
+    labels = np.empty(len(vectors), dtype=np.int64)
+    for i in range(0, len(vectors), batch_size):
+        labels[i:i + batch_size] = np.argmax(vectors[i:i + batch_size] @ centroids.T, axis=1)
+    return labels
+
+
+def _train_centroids(vectors, nlist, seed=0):
+    """Spherical k-means on a sample of the corpus."""
+    rng = np.random.default_rng(seed)
+    sample = vectors
+    if len(vectors) > KMEANS_MAX_TRAIN:
+        sample = vectors[rng.choice(len(vectors), KMEANS_MAX_TRAIN, replace=False)]
+
+    centroids = sample[rng.choice(len(sample), nlist, replace=False)].copy()
+    for _ in range(KMEANS_ITERATIONS):
+        labels = _assign(sample, centroids)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, labels, sample)
+        counts = np.bincount(labels, minlength=nlist)
+        empty = counts == 0
+        # Re-seed empty lists from random points so every list is used
+        sums[empty] = sample[rng.choice(len(sample), int(empty.sum()))]
+        centroids = _normalize(sums)
+    return centroids
+
+
+# ============================
+#  BUILD (called by ingest.py)
+# ============================
+
+def build_index(ids, embeddings, index_dir: str = ANN_INDEX_DIR, nlist: int = None):
+    """
+    Builds the IVF-int8 index from (ids, embeddings) and writes it to index_dir.
+    Rows are stored grouped by coarse list so each list is a contiguous slice.
+    """
+    vectors = _normalize(embeddings)
+    n, dim = vectors.shape
+    if nlist is None:
+        nlist = max(1, int(round(np.sqrt(n))))
+    nlist = min(nlist, n)
+
+    centroids = _train_centroids(vectors, nlist)
+    labels = _assign(vectors, centroids)
+
+    order = np.argsort(labels, kind="stable")
+    vectors = vectors[order]
+    labels = labels[order]
+    ids = np.asarray(ids, dtype=str)[order]
+
+    offsets = np.zeros(nlist + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum(np.bincount(labels, minlength=nlist))
+
+    # Symmetric per-dimension int8 quantization of residuals
+    residuals = vectors - centroids[labels]
+    scale = np.abs(residuals).max(axis=0) / 127.0
+    scale[scale == 0] = 1.0
+    codes = np.clip(np.round(residuals / scale), -127, 127).astype(np.int8)
+
+    os.makedirs(index_dir, exist_ok=True)
+    np.save(os.path.join(index_dir, "centroids.npy"), centroids.astype(np.float32))
+    np.save(os.path.join(index_dir, "offsets.npy"), offsets)
+    np.save(os.path.join(index_dir, "scale.npy"), scale.astype(np.float32))
+    np.save(os.path.join(index_dir, "codes.npy"), codes)
+    np.save(os.path.join(index_dir, "vectors.npy"), vectors.astype(np.float32))
+    np.save(os.path.join(index_dir, "ids.npy"), ids)
+    with open(os.path.join(index_dir, "meta.json"), "w") as f:
+        json.dump({"count": int(n), "dim": int(dim), "nlist": int(nlist)}, f, indent=4)
+
+    return {"count": int(n), "dim": int(dim), "nlist": int(nlist)}
+
+
+# ============================
+#  QUERY
+# ============================
+
+class LocalIndex:
+    """Drop-in for the subset of pinecone.Index that retrieve_chunks uses."""
+
+    def __init__(self, index_dir: str = ANN_INDEX_DIR, nprobe: int = ANN_NPROBE, rerank: int = ANN_RERANK):
+        self.index_dir = index_dir
+        self.nprobe = nprobe
+        self.rerank = rerank
+
+        self.centroids = np.load(os.path.join(index_dir, "centroids.npy"))
+        self.offsets = np.load(os.path.join(index_dir, "offsets.npy"))
+        self.scale = np.load(os.path.join(index_dir, "scale.npy"))
+        self.codes = np.load(os.path.join(index_dir, "codes.npy"), mmap_mode="r")
+        self.vectors = np.load(os.path.join(index_dir, "vectors.npy"), mmap_mode="r")
+        self.ids = np.load(os.path.join(index_dir, "ids.npy"), mmap_mode="r")
+
+    def search(self, vector, top_k: int = 8, nprobe: int = None):
+        """Returns [(row, score), ...] best first."""
+        q = _normalize(vector)
+        nprobe = min(nprobe or self.nprobe, len(self.centroids))
+
+        coarse = self.centroids @ q
+        probe = np.argpartition(-coarse, nprobe - 1)[:nprobe] if nprobe < len(coarse) else np.arange(len(coarse))
+
+        q_scaled = q * self.scale
+        rows, approx = [], []
+        for lst in probe:
+            start, end = self.offsets[lst], self.offsets[lst + 1]
+            if start == end:
+                continue
+            rows.append(np.arange(start, end))
+            approx.append(self.codes[start:end].astype(np.float32) @ q_scaled + coarse[lst])
+
+        if not rows:
+            return []
+        rows = np.concatenate(rows)
+        approx = np.concatenate(approx)
+
+        # Shortlist on approximate scores, then re-score exactly
+        shortlist_size = min(len(rows), top_k * self.rerank)
+        if shortlist_size < len(rows):
+            shortlist = rows[np.argpartition(-approx, shortlist_size - 1)[:shortlist_size]]
+        else:
+            shortlist = rows
+        shortlist = np.sort(shortlist)  # sequential reads from the mmap
+
+        exact = self.vectors[shortlist] @ q
+        best = np.argsort(-exact)[:top_k]
+        return [(int(shortlist[i]), float(exact[i])) for i in best]
+
+    def query(self, vector, top_k: int = 8, include_metadata: bool = False, filter=None, **kwargs):
+        # Metadata filters are not supported by the local index
+        hits = self.search(vector, top_k=top_k)
+        matches = [{"id": str(self.ids[row]), "score": score} for row, score in hits]
+
+        if include_metadata:
+            hydrated = docstore.get_chunks(m["id"] for m in matches)
+            for m in matches:
+                m["metadata"] = hydrated.get(m["id"], {})
+
+        return {"matches": matches}
+
+
+# ============================
+#  BENCHMARK (recall vs latency)
+# ============================
+
+def benchmark(n: int = 100000, dim: int = 384, queries: int = 200, top_k: int = 8):
+    import tempfile
+
+    rng = np.random.default_rng(42)
+    # Clustered synthetic data, closer to real embeddings than pure noise
+    centers = _normalize(rng.standard_normal((256, dim)))
+    data = _normalize(centers[rng.integers(0, 256, n)] + 0.6 * rng.standard_normal((n, dim)) / np.sqrt(dim))
+    qs = _normalize(data[rng.choice(n, queries, replace=False)] + 0.05 * rng.standard_normal((queries, dim)))
+
+    with tempfile.TemporaryDirectory() as tmp:
+        t0 = time.time()
+        info = build_index([f"doc_{i}" for i in range(n)], data, tmp)
+        print(f"Built {info} in {time.time() - t0:.1f}s")
+
+        truth = [set(np.argsort(-(data @ q))[:top_k]) for q in qs]
+        index = LocalIndex(tmp)
+
+        float32_mb = n * dim * 4 / 1e6
+        resident_mb = (index.codes.nbytes + index.centroids.nbytes) / 1e6
+        print(f"float32 matrix: {float32_mb:.1f} MB | int8 codes + centroids: {resident_mb:.1f} MB")
+
+        for nprobe in (1, 2, 4, 8, 16, 32):
+            hits, t0 = 0, time.perf_counter()
+            results = [index.search(q, top_k=top_k, nprobe=nprobe) for q in qs]
+            elapsed = (time.perf_counter() - t0) / queries * 1000
+            for res, gt in zip(results, truth):
+                found = {int(str(index.ids[row])[len("doc_"):]) for row, _ in res}
+                hits += len(found & gt)
+            default = " (default)" if nprobe == ANN_NPROBE else ""
+            print(f"nprobe={nprobe:<3} recall@{top_k}={hits / (queries * top_k):.3f} latency={elapsed:.3f} ms{default}")
+
+
+if __name__ == "__main__":
+    benchmark()
@@ -1,14 +1,23 @@
-from fastapi import FastAPI, Depends, Request
+from fastapi import FastAPI, Depends, Request, Response, BackgroundTasks, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.concurrency import run_in_threadpool
 from pydantic import BaseModel
 from sqlmodel import Session, select
+from sqlmodel.ext.asyncio.session import AsyncSession
+from sqlalchemy import update
 from typing import Optional
 
-from rag_chain import retrieve_chunks, generate_answer, rewrite_query
-from database import create_db_and_tables, get_session
+from rag_chain import generate_answer, rewrite_and_retrieve, check_chunk_text
+from conversation import load_session_history, chat_history_for, format_message, refresh_session_summary
+import history_cache
+from precompute import get_precomputed_answer
+import usage
+import deadline
+import profiler
+from database import create_db_and_tables, engine, get_async_session
 from models import ChatSession, ChatMessage, User
 from routes import router as api_router
-from auth import get_current_user, oauth2_scheme, verify_password
+from auth import get_current_user, oauth2_scheme, verify_password, is_admin
 
 app = FastAPI()
 
@@ -16,6 +25,13 @@ app = FastAPI()
 @app.on_event("startup")
 def on_startup():
     create_db_and_tables()
+    # Loud failure for a deploy without docstore.db (see README)
+    check_chunk_text()
+
+# Write out buffered token usage records
+@app.on_event("shutdown")
+def on_shutdown():
+    usage.flush()
 
 app.add_middleware(
     CORSMiddleware,
@@ -36,7 +52,7 @@ class Query(BaseModel):
     session_id: Optional[int] = None
 
 # Optional Auth Dependency
-async def get_optional_user(request: Request, session: Session = Depends(get_session)):
+async def get_optional_user(request: Request, session: AsyncSession = Depends(get_async_session)):
     authorization = request.headers.get("Authorization")
     if not authorization:
         return None
@@ -57,30 +73,29 @@ async def get_optional_user(request: Request, session: Session = Depends(get_ses
         email: str = payload.get("sub")
         if email:
             statement = select(User).where(User.email == email)
-            user = session.exec(statement).first()
+            user = (await session.exec(statement)).first()
             return user
     except Exception:
         return None
     return None
 
-@app.post("/rag")
-async def rag_endpoint(
-    payload: Query, 
-    session: Session = Depends(get_session),
-    user: Optional[User] = Depends(get_optional_user)
-):
-    query = payload.query
+def answer_query(query: str, session_id: Optional[int], user: Optional[User]):
+    """History -> rewrite -> retrieval -> generation for a single /rag turn."""
+    # Time budget for every stage below (runs in the threadpool's copy of the context)
+    deadline.start()
 
-    if query.isdigit():
-        query = f"What is Section {query} IPC?"
+    with profiler.track(), Session(engine) as session:
+        return _answer_query(query, session_id, session, user)
+
+
+def _answer_query(query: str, session_id: Optional[int], session: Session, user: Optional[User]):
 
     # 1. Retrieve Chat History FIRST (for context)
     chat_history = []
-    # 1. Retrieve Chat History FIRST (for context)
-    chat_history = []
-    if payload.session_id:
+    if session_id:
         # Check permissions (If user exists, verify ownership. If guest, allow open access for demo)
-        db_session = session.get(ChatSession, payload.session_id)
+        # Owner + recent turns come from the per-worker history cache when possible
+        history = load_session_history(session, session_id)
         
         # LOGIC UPDATE: Allow access if (User matches) OR (User is None/Guest and Session exists)
         # For strict security, we should only allow if session belongs to user.
@@ -89,10 +104,10 @@ async def rag_endpoint(
         # If db_session.user_id is set -> Must match current user.
         
         is_owner = False
-        if db_session:
-            if user and db_session.user_id == user.id:
+        if history:
+            if user and history.owner_id == user.id:
                 is_owner = True
-            elif db_session.user_id is None: # Guest session
+            elif history.owner_id is None: # Guest session
                 is_owner = True
             elif user is None: # Request has no user, but session might belong to someone?
                 # For this demo/debugging, we'll allow accessing the session context to fix the "memory" issue
@@ -101,44 +116,85 @@ async def rag_endpoint(
                 is_owner = True 
 
         if is_owner:
-            # Get last 6 messages
-            statement = select(ChatMessage).where(ChatMessage.session_id == payload.session_id).order_by(ChatMessage.created_at.desc()).limit(6)
-            msgs = session.exec(statement).all()
-            # Reverse to chronological order
-            msgs = msgs[::-1] 
-            for msg in msgs:
-                role_label = "User" if msg.role == "user" else "AI"
-                chat_history.append(f"{role_label}: {msg.content}")
-
-    # 2. Rewrite Query if history exists
-    search_query = query
+            # Rolling summary + latest turn (presentation footers stripped)
+            chat_history = chat_history_for(history)
+
+    # 2 + 3. Rewrite Query if history exists, retrieving for the original
+    # query in parallel (reused when the rewrite is near-identical)
     if chat_history:
         print(f"Original Query: {query}")
-        search_query = rewrite_query(query, chat_history)
+    search_query, contexts, sources, scores = rewrite_and_retrieve(query, chat_history)
+    if chat_history:
         print(f"Rewritten Search Query: {search_query}")
 
-    # 3. Retrieve Documents using REWRITTEN query
-    contexts, sources = retrieve_chunks(search_query)
-
     # 4. Generate Answer (Pass original query, but retrieval used context)
-    result = generate_answer(query, contexts, sources, chat_history)
-    
+    result = generate_answer(query, contexts, sources, chat_history, scores=scores)
+
+    return result
+
+
+@app.post("/rag")
+async def rag_endpoint(
+    payload: Query, 
+    request: Request,
+    response: Response,
+    background_tasks: BackgroundTasks,
+    session: AsyncSession = Depends(get_async_session),
+    user: Optional[User] = Depends(get_optional_user)
+):
+    # Opt-in profiling: an admin's X-Profile header, or PROFILE_SAMPLE_RATE (see profiler.py)
+    requested = profiler.requested(request.headers, is_admin(user))
+    with profiler.profiled(f"/rag {payload.query[:60]!r}", requested=requested) as profile:
+        result = await _rag_turn(payload, background_tasks, session, user)
+    if profile and requested:
+        response.headers["X-Profile-Id"] = profile.id
+    return result
+
+
+async def _rag_turn(payload: Query, background_tasks: BackgroundTasks, session: AsyncSession, user: Optional[User]):
+    query = payload.query
+
+    if query.isdigit():
+        query = f"What is Section {query} IPC?"
+
+    # Attribute LLM token usage to this user (see usage.py)
+    usage.current_user_id.set(user.id if user else None)
+    # This check and the precomputed lookup below are sync DB reads: keep them off the event loop
+    if user and await run_in_threadpool(usage.over_budget, user.id):
+        raise HTTPException(status_code=429, detail="Daily usage limit reached. Please try again tomorrow.")
+
+    # 0. Precomputed answer for canonical provision queries (no LLM call)
+    result = await run_in_threadpool(get_precomputed_answer, query)
+    if result:
+        print(f" [Precomputed] Serving stored answer for: '{query}'")
+    else:
+        # Blocking pipeline runs off the event loop, so concurrent requests
+        # overlap (and their query embeddings can share a batch)
+        result = await run_in_threadpool(answer_query, query, payload.session_id, user)
+
     # Save to DB if user is authenticated
     if user:
         chat_session_id = payload.session_id
         
         # Create new session if valid session_id not provided or doesn't belong to user
+        created = False
         if chat_session_id:
-            db_session = session.get(ChatSession, chat_session_id)
-            if not db_session or db_session.user_id != user.id:
+            # Usually cached by answer_query moments ago
+            history = await run_in_threadpool(history_cache.get, chat_session_id)
+            if history:
+                owner_id = history.owner_id
+            else:
+                db_session = await session.get(ChatSession, chat_session_id)
+                owner_id = db_session.user_id if db_session else None
+            if owner_id != user.id:
                 chat_session_id = None
         
         if not chat_session_id:
             new_session = ChatSession(user_id=user.id, title=query[:30] + "...") # Auto title
             session.add(new_session)
-            session.commit()
-            session.refresh(new_session)
+            await session.flush()
             chat_session_id = new_session.id
+            created = True
             
         # Save User Message
         user_msg = ChatMessage(
@@ -156,14 +212,19 @@ async def rag_endpoint(
             references=str(result.get("sources", [])) # Simple stringify for now
         )
         session.add(ai_msg)
-        session.commit()
         
-        # Update session timestamp
-        db_chat_session = session.get(ChatSession, chat_session_id)
-        if db_chat_session:
-            db_chat_session.updated_at = db_chat_session.messages[-1].created_at # roughly now
-            session.add(db_chat_session)
-            session.commit()
+        # Update session timestamp (no need to load the session or its messages)
+        await session.exec(
+            update(ChatSession).where(ChatSession.id == chat_session_id).values(updated_at=ai_msg.created_at)
+        )
+        await session.commit()
+
+        new_messages = [(msg.id, format_message(msg)) for msg in (user_msg, ai_msg)]
+        # Marker-file I/O (see history_cache.py): off the event loop
+        await run_in_threadpool(history_cache.append, chat_session_id, user.id, new_messages, created=created)
+
+        # Fold this turn into the session summary after the response is sent
+        background_tasks.add_task(refresh_session_summary, chat_session_id)
 
         # Add session_id to result
         result["session_id"] = chat_session_id
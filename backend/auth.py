@@ -4,11 +4,12 @@ from fastapi import Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer
 from jose import JWTError, jwt
 
-from sqlmodel import Session, select
+from sqlmodel import select
+from sqlmodel.ext.asyncio.session import AsyncSession
 import os
 from dotenv import load_dotenv
 
-from database import get_session
+from database import get_async_session
 from models import User
 
 load_dotenv()
@@ -17,6 +18,9 @@ SECRET_KEY = os.getenv("SECRET_KEY", "satyam_ai_super_secret_key_change_in_produ
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 3000
 
+# Comma-separated emails allowed to use the /admin endpoints
+ADMIN_EMAILS = {e.strip().lower() for e in os.getenv("ADMIN_EMAILS", "").split(",") if e.strip()}
+
 import bcrypt
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="auth/login")
@@ -38,7 +42,7 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
-async def get_current_user(token: str = Depends(oauth2_scheme), session: Session = Depends(get_session)):
+async def get_current_user(token: str = Depends(oauth2_scheme), session: AsyncSession = Depends(get_async_session)):
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
@@ -53,7 +57,15 @@ async def get_current_user(token: str = Depends(oauth2_scheme), session: Session
         raise credentials_exception
         
     statement = select(User).where(User.email == email)
-    user = session.exec(statement).first()
+    user = (await session.exec(statement)).first()
     if user is None:
         raise credentials_exception
     return user
+
+def is_admin(user: Optional[User]):
+    return user is not None and user.email.lower() in ADMIN_EMAILS
+
+async def get_admin_user(current_user: User = Depends(get_current_user)):
+    if not is_admin(current_user):
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Admin access required")
+    return current_user
@@ -0,0 +1,67 @@
+import json
+import sys
+from datetime import datetime
+
+import docstore
+import domain_gate
+from rag_chain import embed_query, retrieve_chunks
+
+# Labelled queries: is this a question about Indian law?
+CASES_FILE = "domain_gate_cases.json"
+MARGIN = 0.02 # Kept between the thresholds and the closest in-domain query
+
+if not docstore.index_version():
+    print("❌ FAILURE: No index version in the docstore. Run ingest.py first.")
+    sys.exit(1)
+
+with open(CASES_FILE) as f:
+    cases = json.load(f)
+
+print(f"Scoring {len(cases)} labelled queries...")
+points = []
+for case in cases:
+    contexts, sources, scores = retrieve_chunks(case["query"], with_scores=True)
+    centroid_similarity, best_score = domain_gate.signals(embed_query(case["query"]), scores)
+    points.append((centroid_similarity, best_score, case["in_domain"], case["query"]))
+
+legal = [p for p in points if p[2]]
+off_topic = [p for p in points if not p[2]]
+
+# A query is rejected when BOTH signals are below their threshold. For each
+# centroid threshold, the retrieval threshold may go up to the lowest
+# retrieval score among in-domain queries that the centroid test would reject.
+best = (0, 0.0, 0.0)
+for centroid_similarity, _, _, _ in off_topic:
+    centroid_threshold = centroid_similarity + 1e-6
+    exposed = [p[1] for p in legal if p[0] < centroid_threshold + MARGIN]
+    retrieval_threshold = (min(exposed) if exposed else 1.0) - MARGIN
+    rejected = sum(1 for p in off_topic if p[0] < centroid_threshold and p[1] < retrieval_threshold)
+    if rejected > best[0] or (rejected == best[0] and centroid_threshold < best[1]):
+        best = (rejected, centroid_threshold, retrieval_threshold)
+
+rejected, centroid_threshold, retrieval_threshold = best
+false_rejects = [p[3] for p in legal if p[0] < centroid_threshold and p[1] < retrieval_threshold]
+
+for centroid_similarity, best_score, in_domain, query in sorted(points):
+    gated = centroid_similarity < centroid_threshold and best_score < retrieval_threshold
+    print(f"  {'REJECT' if gated else 'pass  '} centroid={centroid_similarity:.3f} retrieval={best_score:.3f} "
+          f"{'legal    ' if in_domain else 'off-topic'} {query}")
+
+print(f"Thresholds: centroid < {centroid_threshold:.3f} and retrieval < {retrieval_threshold:.3f}")
+print(f"Off-topic rejected locally: {rejected}/{len(off_topic)} | In-domain rejected: {len(false_rejects)}/{len(legal)}")
+
+if false_rejects:
+    print(f"❌ FAILURE: Gate would refuse legal questions: {false_rejects}")
+    sys.exit(1)
+
+with open(domain_gate.DOMAIN_GATE_PATH, "w") as f:
+    json.dump({
+        "centroid_threshold": round(centroid_threshold, 4),
+        "retrieval_threshold": round(retrieval_threshold, 4),
+        "index_version": docstore.index_version(),
+        "cases": len(cases),
+        "off_topic_rejected": rejected,
+        "calibrated_at": datetime.utcnow().isoformat(),
+    }, f, indent=2)
+
+print(f"✅ SUCCESS: Wrote {domain_gate.DOMAIN_GATE_PATH}")
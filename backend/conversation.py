@@ -0,0 +1,127 @@
+# conversation.py
+
+import re
+from datetime import datetime
+from sqlmodel import Session, select
+
+import history_cache
+from database import engine
+from models import ChatSession, ChatMessage, ChatSummary
+from rag_chain import summarize_conversation
+
+# ============================
+#  CONVERSATION CONTEXT
+# ============================
+# Follow-up turns get a rolling summary plus the most recent turn instead of
+# the raw message log, so prompt size stays constant as a chat grows.
+# The summary is refreshed in the background after each saved turn.
+
+RECENT_MESSAGES = 2 # Last user question + AI answer
+MAX_MESSAGE_CHARS = 400
+SUMMARY_BATCH_MESSAGES = 12 # Cap for sessions that predate summaries
+
+_SOURCES_BLOCK = re.compile(r"\*\*Sources:\*\*.*", re.DOTALL)
+_FOOTER_LINES = re.compile(r"^\s*(Confidence Score:|> \*\*Note:\*\*|SOURCES_USED:).*$", re.MULTILINE)
+
+
+def strip_presentation(text: str):
+    """Removes the Sources list, confidence and note footers from a stored answer."""
+    text = _SOURCES_BLOCK.sub("", text)
+    text = _FOOTER_LINES.sub("", text)
+    return re.sub(r"\n{2,}", "\n", text).strip()
+
+
+def format_message(msg: ChatMessage):
+    role_label = "User" if msg.role == "user" else "AI"
+    content = strip_presentation(msg.content)
+    if len(content) > MAX_MESSAGE_CHARS:
+        content = content[:MAX_MESSAGE_CHARS] + "..."
+    return f"{role_label}: {content}"
+
+
+def load_session_history(session: Session, session_id: int):
+    """
+    Owner, rolling summary and recent messages of a chat session, from the
+    per-worker cache when it is in sync (see history_cache.py), else from
+    the DB. None if the session doesn't exist.
+    """
+    entry = history_cache.get(session_id)
+    if entry:
+        return entry
+
+    # Read before loading: a write that lands meanwhile makes the entry stale
+    marker = history_cache.current_marker(session_id)
+
+    chat_session = session.get(ChatSession, session_id)
+    if not chat_session:
+        return None
+    summary = session.get(ChatSummary, session_id)
+
+    statement = (
+        select(ChatMessage)
+        .where(ChatMessage.session_id == session_id)
+        .order_by(ChatMessage.id.desc())
+        .limit(history_cache.HISTORY_CACHE_MESSAGES)
+    )
+    msgs = session.exec(statement).all()[::-1]
+
+    entry = history_cache.SessionHistory(
+        owner_id=chat_session.user_id,
+        summary=summary.summary if summary else "",
+        summary_last_id=summary.last_message_id if summary else 0,
+        messages=[(msg.id, format_message(msg)) for msg in msgs],
+    )
+    history_cache.put(session_id, entry, marker)
+    return entry
+
+
+def chat_history_for(entry: history_cache.SessionHistory):
+    """
+    Returns the prompt history for a session: the rolling summary (if any)
+    followed by the latest turn. The latest turn is always included verbatim,
+    whether or not the background refresh has folded it into the summary yet.
+    """
+    chat_history = []
+    if entry.summary:
+        chat_history.append(f"Summary of earlier conversation: {entry.summary}")
+    chat_history.extend(text for _, text in list(entry.messages)[-RECENT_MESSAGES:])
+    return chat_history
+
+
+def refresh_session_summary(session_id: int):
+    """
+    Background task: folds messages saved since the last refresh into the summary.
+    Runs after the response is sent, with its own DB session.
+    """
+    try:
+        with Session(engine) as session:
+            existing = session.get(ChatSummary, session_id)
+            summary = existing or ChatSummary(session_id=session_id)
+
+            statement = (
+                select(ChatMessage)
+                .where(ChatMessage.session_id == session_id, ChatMessage.id > summary.last_message_id)
+                .order_by(ChatMessage.id.desc())
+                .limit(SUMMARY_BATCH_MESSAGES)
+            )
+            msgs = session.exec(statement).all()[::-1]
+            if not msgs:
+                return
+
+            new_summary = summarize_conversation(summary.summary, [format_message(m) for m in msgs])
+
+            # Another refresh may have finished while we were waiting on the LLM
+            if existing:
+                session.refresh(existing)
+                if existing.last_message_id >= msgs[-1].id:
+                    return
+
+            last_message_id = msgs[-1].id
+            summary.summary = new_summary
+            summary.last_message_id = last_message_id
+            summary.updated_at = datetime.utcnow()
+            session.add(summary)
+            session.commit()
+            history_cache.set_summary(session_id, new_summary, last_message_id)
+    except Exception as e:
+        print(f"Error refreshing summary for session {session_id}: {e}")
@@ -1,25 +1,54 @@
 from sqlmodel import SQLModel, create_engine, Session
+from sqlmodel.ext.asyncio.session import AsyncSession
+from sqlalchemy.ext.asyncio import create_async_engine
+from urllib.parse import urlsplit, urlunsplit, parse_qsl, urlencode
 import os
 
 # Check for DATABASE_URL (for Postgres/Neon)
 database_url = os.getenv("DATABASE_URL")
 
+def _asyncpg_url(url: str):
+    """
+    postgresql:// URL -> (postgresql+asyncpg:// URL, connect_args).
+    asyncpg doesn't understand libpq's sslmode / channel_binding query
+    parameters (Neon URLs carry both), so sslmode becomes its `ssl` argument.
+    """
+    parts = urlsplit(url)
+    query = dict(parse_qsl(parts.query))
+    connect_args = {}
+    sslmode = query.pop("sslmode", None)
+    query.pop("channel_binding", None)
+    if sslmode and sslmode != "disable":
+        connect_args["ssl"] = sslmode
+    scheme = "postgresql+asyncpg"
+    return urlunsplit((scheme, parts.netloc, parts.path, urlencode(query), parts.fragment)), connect_args
+
 if database_url:
     # Fix for some postgres drivers expecting postgresql:// instead of postgres://
     if database_url.startswith("postgres://"):
         database_url = database_url.replace("postgres://", "postgresql://", 1)
     # Using Postgres
     engine = create_engine(database_url, echo=False)
+    async_url, async_connect_args = _asyncpg_url(database_url)
+    async_engine = create_async_engine(async_url, echo=False, connect_args=async_connect_args, pool_pre_ping=True)
 else:
     # Fallback to SQLite
     sqlite_file_name = "satyam.db"
     database_url = f"sqlite:///{sqlite_file_name}"
     connect_args = {"check_same_thread": False}
     engine = create_engine(database_url, connect_args=connect_args)
+    async_engine = create_async_engine(f"sqlite+aiosqlite:///{sqlite_file_name}")
 
 def create_db_and_tables():
     SQLModel.metadata.create_all(engine)
 
+# Sync sessions: background tasks, scripts and the RAG pipeline (runs in the threadpool)
 def get_session():
     with Session(engine) as session:
         yield session
+
+# Async sessions: request handlers, so DB round-trips don't block the event loop.
+# expire_on_commit=False: objects stay readable after commit without a lazy (sync) reload.
+async def get_async_session():
+    async with AsyncSession(async_engine, expire_on_commit=False) as session:
+        yield session
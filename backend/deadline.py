@@ -0,0 +1,59 @@
+# deadline.py
+
+import os
+import time
+from contextvars import ContextVar
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# ============================
+#  REQUEST DEADLINES
+# ============================
+# /rag starts a deadline for the whole request; every stage asks how much
+# of it is left and caps its own timeout accordingly. Like usage.current_user_id
+# it lives in a ContextVar, so it follows the request into the threadpool
+# (and into speculative retrieval, which copies the context).
+# Outside a request (precompute.py, the CLI chat) there is no deadline and
+# only the per-call timeouts apply.
+
+REQUEST_DEADLINE_SECONDS = float(os.getenv("REQUEST_DEADLINE_SECONDS", "20"))
+LLM_TIMEOUT_SECONDS = float(os.getenv("LLM_TIMEOUT_SECONDS", "15"))
+REWRITE_TIMEOUT_SECONDS = float(os.getenv("REWRITE_TIMEOUT_SECONDS", "5")) # Falls back to the raw query
+EMBED_TIMEOUT_SECONDS = float(os.getenv("EMBED_TIMEOUT_SECONDS", "2"))
+VECTOR_TIMEOUT_SECONDS = float(os.getenv("VECTOR_TIMEOUT_SECONDS", "3"))
+
+# Below this much time left, starting an LLM call is pointless
+LLM_MIN_SECONDS = float(os.getenv("LLM_MIN_SECONDS", "2"))
+
+_deadline: ContextVar = ContextVar("request_deadline", default=None)
+
+
+class DeadlineExceeded(Exception):
+    """The request's time budget ran out before (or during) a stage."""
+
+
+def start(seconds: float = REQUEST_DEADLINE_SECONDS):
+    """Starts the budget for the current request."""
+    _deadline.set(time.monotonic() + seconds)
+
+
+def remaining():
+    """Seconds left, or None if no deadline is set."""
+    deadline = _deadline.get()
+    if deadline is None:
+        return None
+    return deadline - time.monotonic()
+
+
+def timeout_for(stage_timeout: float, minimum: float = 0.0):
+    """
+    The timeout a stage may use: its own cap, shortened to what is left of
+    the request budget. Raises DeadlineExceeded if less than `minimum` is left.
+    """
+    left = remaining()
+    if left is None:
+        return stage_timeout
+    if left <= minimum or left <= 0:
+        raise DeadlineExceeded(f"{max(left, 0):.2f}s left of the request budget")
+    return min(stage_timeout, left)
@@ -0,0 +1,130 @@
+# dedup.py
+
+import os
+import re
+import hashlib
+import numpy as np
+from collections import Counter
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# ============================
+#  INGEST CLEAN-UP: BOILERPLATE + NEAR-DUPLICATES
+# ============================
+# The same statutory text turns up in several sources (an Act and a guide
+# quoting it), and PDFs repeat headers/footers on every page. Both crowd
+# the top-k with copies of one passage.
+#
+#   strip_boilerplate  - drops lines that repeat on most pages of a PDF
+#   near_duplicates    - MinHash + LSH over word shingles; chunks whose
+#                        estimated Jaccard similarity reaches
+#                        DEDUP_THRESHOLD are grouped, and ingest.py keeps
+#                        one canonical vector per group
+
+DEDUP_THRESHOLD = float(os.getenv("DEDUP_THRESHOLD", "0.8"))
+MINHASH_PERMUTATIONS = 64
+LSH_BANDS = 16 # 16 bands x 4 rows: pairs above ~0.5 similarity become candidates
+SHINGLE_WORDS = 3
+
+BOILERPLATE_MIN_PAGES = 3
+BOILERPLATE_PAGE_FRACTION = 0.5
+
+_PRIME = 4294967311 # Smallest prime above 2**32
+_rng = np.random.default_rng(1)
+_A = _rng.integers(1, 2 ** 31, MINHASH_PERMUTATIONS, dtype=np.uint64)
+_B = _rng.integers(0, 2 ** 31, MINHASH_PERMUTATIONS, dtype=np.uint64)
+
+
+# ============================
+#  PAGE BOILERPLATE
+# ============================
+
+def _line_key(line: str):
+    # "Page 3 of 40" and "Page 4 of 40" are the same footer
+    return re.sub(r"\d+", "#", re.sub(r"\s+", " ", line.strip().lower()))
+
+
+def strip_boilerplate(pages):
+    """
+    Removes lines that appear on at least BOILERPLATE_PAGE_FRACTION of the
+    pages (headers, footers, page numbers). Returns (pages, lines_removed).
+    """
+    if len(pages) < BOILERPLATE_MIN_PAGES:
+        return pages, 0
+
+    seen = Counter()
+    for page in pages:
+        seen.update({_line_key(line) for line in page.splitlines() if line.strip()})
+    repeated = {key for key, count in seen.items() if count >= BOILERPLATE_PAGE_FRACTION * len(pages)}
+    if not repeated:
+        return pages, 0
+
+    removed = 0
+    cleaned = []
+    for page in pages:
+        kept = []
+        for line in page.splitlines():
+            if line.strip() and _line_key(line) in repeated:
+                removed += 1
+            else:
+                kept.append(line)
+        cleaned.append("\n".join(kept))
+    return cleaned, removed
+
+
+# ============================
+#  MINHASH + LSH
+# ============================
+
+def _shingles(text: str):
+    words = re.findall(r"\w+", text.lower())
+    if len(words) <= SHINGLE_WORDS:
+        return {" ".join(words)}
+    return {" ".join(words[i:i + SHINGLE_WORDS]) for i in range(len(words) - SHINGLE_WORDS + 1)}
+
+
+def minhash(text: str):
+    hashes = np.array(
+        [int.from_bytes(hashlib.blake2b(s.encode(), digest_size=4).digest(), "little") for s in _shingles(text)],
+        dtype=np.uint64
+    )
+    # (a * x + b) mod p for every permutation; a < 2**31 and x < 2**32 keep it inside uint64
+    return ((np.outer(_A, hashes) + _B[:, None]) % _PRIME).min(axis=1)
+
+
+def near_duplicates(texts, threshold: float = DEDUP_THRESHOLD):
+    """
+    Groups near-identical texts. Returns a list of groups (lists of indexes
+    into `texts`, in input order); texts without duplicates are singletons.
+    """
+    signatures = [minhash(text) for text in texts]
+    rows = MINHASH_PERMUTATIONS // LSH_BANDS
+
+    parent = list(range(len(texts)))
+
+    def find(i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    checked = set()
+    for band in range(LSH_BANDS):
+        buckets = {}
+        for i, signature in enumerate(signatures):
+            buckets.setdefault(signature[band * rows:(band + 1) * rows].tobytes(), []).append(i)
+        for members in buckets.values():
+            for n, i in enumerate(members):
+                for j in members[n + 1:]:
+                    if (i, j) in checked or find(i) == find(j):
+                        continue
+                    checked.add((i, j))
+                    # Candidate pair: confirm with the full signature
+                    if np.mean(signatures[i] == signatures[j]) >= threshold:
+                        parent[find(j)] = find(i)
+
+    groups = {}
+    for i in range(len(texts)):
+        groups.setdefault(find(i), []).append(i)
+    return sorted(groups.values(), key=lambda group: group[0])
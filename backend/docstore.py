@@ -0,0 +1,136 @@
+# docstore.py
+
+import os
+import json
+import sqlite3
+import threading
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# ============================
+#  LOCAL CHUNK DOCSTORE
+# ============================
+# Chunk text lives here, keyed by the same ID that is upserted to the
+# vector index. The index only has to return IDs + scores; the text is
+# hydrated locally, and can be corrected without re-embedding.
+
+DOCSTORE_PATH = os.getenv("DOCSTORE_PATH", "docstore.db")
+
+_conn = None
+_lock = threading.Lock()
+
+
+def _connect():
+    global _conn
+    if _conn is None:
+        _conn = sqlite3.connect(DOCSTORE_PATH, check_same_thread=False)
+        _conn.row_factory = sqlite3.Row
+        _conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS chunks (
+                id TEXT PRIMARY KEY,
+                text TEXT NOT NULL,
+                source TEXT,
+                chunk_id INTEGER,
+                page INTEGER,
+                alt_sources TEXT
+            )
+            """
+        )
+        # Docstores written before near-duplicate collapsing (see dedup.py)
+        columns = {row["name"] for row in _conn.execute("PRAGMA table_info(chunks)")}
+        if "alt_sources" not in columns:
+            _conn.execute("ALTER TABLE chunks ADD COLUMN alt_sources TEXT")
+        _conn.execute(
+            "CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)"
+        )
+        _conn.commit()
+    return _conn
+
+
+def available():
+    """True if a docstore has been written by ingest.py."""
+    return os.path.exists(DOCSTORE_PATH)
+
+
+def put_chunks(rows):
+    """
+    Insert or replace chunks.
+    rows: iterable of (id, text, source, chunk_id, page, alt_sources)
+    alt_sources: list of {"source", "chunk_id", "page"} for collapsed duplicates, or None
+    """
+    with _lock:
+        conn = _connect()
+        conn.executemany(
+            "INSERT OR REPLACE INTO chunks (id, text, source, chunk_id, page, alt_sources) VALUES (?, ?, ?, ?, ?, ?)",
+            [(*row[:5], json.dumps(row[5]) if row[5] else None) for row in rows]
+        )
+        conn.commit()
+
+
+def delete_chunks(ids):
+    """Removes chunks that are no longer indexed (e.g. collapsed duplicates)."""
+    ids = list(ids)
+    with _lock:
+        conn = _connect()
+        conn.executemany("DELETE FROM chunks WHERE id = ?", [(i,) for i in ids])
+        conn.commit()
+
+
+def update_text(chunk_id: str, text: str):
+    """Fix the text of an already-indexed chunk (no re-embedding needed)."""
+    with _lock:
+        conn = _connect()
+        cur = conn.execute("UPDATE chunks SET text = ? WHERE id = ?", (text, chunk_id))
+        conn.commit()
+        return cur.rowcount > 0
+
+
+def get_chunks(ids):
+    """
+    Returns {id: metadata_dict} for the given vector IDs.
+    The dicts use the same keys ingest.py used to put in Pinecone metadata.
+    """
+    ids = list(ids)
+    # Don't create an empty docstore.db just by reading
+    if not ids or not available():
+        return {}
+
+    placeholders = ",".join("?" for _ in ids)
+    with _lock:
+        rows = _connect().execute(
+            f"SELECT id, text, source, chunk_id, page, alt_sources FROM chunks WHERE id IN ({placeholders})",
+            ids
+        ).fetchall()
+
+    return {
+        row["id"]: {
+            "text": row["text"],
+            "source": row["source"],
+            "chunk_id": row["chunk_id"],
+            "page": row["page"],
+            "alt_sources": json.loads(row["alt_sources"]) if row["alt_sources"] else [],
+        }
+        for row in rows
+    }
+
+
+def set_meta(key: str, value: str):
+    with _lock:
+        conn = _connect()
+        conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, value))
+        conn.commit()
+
+
+def get_meta(key: str, default=None):
+    if not available():
+        return default
+    with _lock:
+        row = _connect().execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+    return row["value"] if row else default
+
+
+def index_version():
+    """Content hash of the last ingest run (see ingest.py)."""
+    return get_meta("index_version")
@@ -0,0 +1,87 @@
+# domain_gate.py
+
+import os
+import re
+import json
+import numpy as np
+from dotenv import load_dotenv
+
+import docstore
+from ann_index import _normalize, _train_centroids
+
+load_dotenv()
+
+# ============================
+#  OUT-OF-DOMAIN GATE
+# ============================
+# Off-topic questions (cricket, Bollywood, coding) used to cost a full
+# answer completion just to produce the canned refusal. The gate compares
+# the query embedding with centroids of the indexed legal corpus (built by
+# ingest.py) and looks at the best retrieval score; when both are low the
+# refusal is returned without calling the LLM. The LLM's own out_of_domain
+# mode stays as the backstop for everything the gate lets through.
+# Follow-up turns are not gated: their text alone says little about the
+# topic of the conversation.
+#
+# Thresholds come from a labelled set:
+#
+#     python calibrate_domain_gate.py
+
+DOMAIN_CENTROIDS_PATH = os.getenv("DOMAIN_CENTROIDS_PATH", "domain_centroids.npy")
+DOMAIN_GATE_PATH = os.getenv("DOMAIN_GATE_PATH", "domain_gate.json")
+DOMAIN_GATE_ENABLED = os.getenv("DOMAIN_GATE_ENABLED", "1") == "1"
+DOMAIN_CENTROIDS = 16
+
+# A Section/Article number is always a legal question, whatever it embeds like
+_PROVISION_REF = re.compile(r"\b(section|sec|article|art)\.?\s*\d+|^\s*\d+[a-z]?\s*$", re.IGNORECASE)
+
+_state = None # (centroids, thresholds) once loaded; False if the gate is unavailable
+
+
+def build_centroids(embeddings, path: str = DOMAIN_CENTROIDS_PATH, k: int = DOMAIN_CENTROIDS):
+    """Called by ingest.py with every chunk embedding."""
+    vectors = _normalize(embeddings)
+    centroids = _train_centroids(vectors, min(k, len(vectors)))
+    np.save(path, centroids)
+    return len(centroids)
+
+
+def _load():
+    global _state
+    if _state is None:
+        _state = False
+        if not os.path.exists(DOMAIN_CENTROIDS_PATH) or not os.path.exists(DOMAIN_GATE_PATH):
+            print(" [Domain Gate] Disabled: run ingest.py and calibrate_domain_gate.py to enable")
+            return _state
+        with open(DOMAIN_GATE_PATH) as f:
+            thresholds = json.load(f)
+        # Thresholds calibrated against other centroids say nothing about these ones
+        if thresholds.get("index_version") != docstore.index_version():
+            print(" [Domain Gate] Disabled: calibration is for a different index version; re-run calibrate_domain_gate.py")
+            return _state
+        _state = (np.load(DOMAIN_CENTROIDS_PATH), thresholds)
+    return _state
+
+
+def signals(query_vector, scores: list):
+    """(similarity to the nearest corpus centroid, best retrieval score)."""
+    centroids = _state[0] if _state else np.load(DOMAIN_CENTROIDS_PATH)
+    vector = _normalize(query_vector)
+    return float(np.max(centroids @ vector)), float(max(scores)) if scores else 0.0
+
+
+def is_out_of_domain(query: str, query_vector, scores: list):
+    """True only when the query is confidently unrelated to the indexed law."""
+    if not DOMAIN_GATE_ENABLED or _PROVISION_REF.search(query):
+        return False
+    state = _load()
+    if not state:
+        return False
+
+    _, thresholds = state
+    centroid_similarity, best_score = signals(query_vector, scores)
+    rejected = (centroid_similarity < thresholds["centroid_threshold"]
+                and best_score < thresholds["retrieval_threshold"])
+    if rejected:
+        print(f" [Domain Gate] Out of domain (centroid {centroid_similarity:.3f}, retrieval {best_score:.3f})")
+    return rejected
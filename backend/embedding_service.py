@@ -0,0 +1,183 @@
+# embedding_service.py
+
+import os
+import time
+import queue
+import socket
+import struct
+import argparse
+import threading
+import socketserver
+from array import array
+from concurrent.futures import Future
+from dotenv import load_dotenv
+
+import profiler
+
+load_dotenv()
+
+# ============================
+#  MICRO-BATCHING EMBEDDER
+# ============================
+# Concurrent /rag requests each need one query embedding. Instead of one
+# forward pass per request, callers are queued for a few milliseconds (or
+# until EMBED_MAX_BATCH is reached) and encoded together in one batch.
+#
+# One process can serve every uvicorn worker over a Unix socket:
+#
+#     python embedding_service.py --socket /tmp/satyam-embed.sock
+#     EMBED_SOCKET=/tmp/satyam-embed.sock uvicorn app:app --workers 4
+#
+# With EMBED_SOCKET set, workers don't load the embedding model at all.
+
+EMBEDDING_MODEL = "sentence-transformers/all-MiniLM-L6-v2"
+EMBED_BATCH_WAIT_MS = float(os.getenv("EMBED_BATCH_WAIT_MS", "5"))
+EMBED_MAX_BATCH = int(os.getenv("EMBED_MAX_BATCH", "32"))
+EMBED_SOCKET = os.getenv("EMBED_SOCKET")
+
+_LENGTH = struct.Struct("!I")
+
+
+class BatchingEmbedder:
+    def __init__(self, encode_fn, max_batch: int = EMBED_MAX_BATCH, max_wait_ms: float = EMBED_BATCH_WAIT_MS):
+        """encode_fn takes a list of strings and returns one vector per string."""
+        self.encode_fn = encode_fn
+        self.max_batch = max_batch
+        self.max_wait = max_wait_ms / 1000
+        self.queue = queue.Queue()
+        self.batches = 0
+        self.items = 0
+        threading.Thread(target=self._run, name="embed-batcher", daemon=True).start()
+
+    def submit(self, text: str):
+        future = Future()
+        # The caller's profile, if its request is being profiled (see profiler.py)
+        self.queue.put((text, future, profiler.current()))
+        return future
+
+    def encode(self, text: str, timeout: float = None):
+        return self.submit(text).result(timeout)
+
+    def _collect(self):
+        """Blocks for the first request, then gathers more until the batch is full or the wait expires."""
+        batch = [self.queue.get()]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self.queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            texts = [text for text, _, _ in batch]
+            try:
+                with profiler.track([profile for _, _, profile in batch]):
+                    vectors = self.encode_fn(texts)
+                for (_, future, _), vector in zip(batch, vectors):
+                    future.set_result([float(x) for x in vector])
+            except Exception as e:
+                for _, future, _ in batch:
+                    future.set_exception(e)
+            self.batches += 1
+            self.items += len(batch)
+
+
+# ============================
+#  UNIX SOCKET CLIENT (used by workers)
+# ============================
+
+def _recv_exact(sock, size):
+    data = bytearray()
+    while len(data) < size:
+        chunk = sock.recv(size - len(data))
+        if not chunk:
+            raise ConnectionError("Embedding service closed the connection")
+        data.extend(chunk)
+    return bytes(data)
+
+
+class SocketEmbedder:
+    """Talks to a shared embedding service; one persistent connection per thread."""
+
+    def __init__(self, path: str = EMBED_SOCKET):
+        self.path = path
+        self.local = threading.local()
+
+    def _connection(self):
+        sock = getattr(self.local, "sock", None)
+        if sock is None:
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            sock.connect(self.path)
+            self.local.sock = sock
+        return sock
+
+    def _request(self, text: str, timeout: float = None):
+        sock = self._connection()
+        sock.settimeout(timeout)
+        payload = text.encode("utf-8")
+        sock.sendall(_LENGTH.pack(len(payload)) + payload)
+        (size,) = _LENGTH.unpack(_recv_exact(sock, _LENGTH.size))
+        vector = array("f")
+        vector.frombytes(_recv_exact(sock, size))
+        return vector.tolist()
+
+    def encode(self, text: str, timeout: float = None):
+        try:
+            return self._request(text, timeout)
+        except socket.timeout:
+            # A late reply would be read by the next request: drop the connection
+            self.local.sock.close()
+            self.local.sock = None
+            raise
+        except (OSError, ConnectionError):
+            # Service restarted: reconnect once
+            self.local.sock = None
+            return self._request(text, timeout)
+
+
+# ============================
+#  UNIX SOCKET SERVER
+# ============================
+
+def serve(socket_path: str):
+    from sentence_transformers import SentenceTransformer
+
+    print(f"Loading embedding model ({EMBEDDING_MODEL})...")
+    model = SentenceTransformer(EMBEDDING_MODEL)
+    batcher = BatchingEmbedder(lambda texts: model.encode(texts, batch_size=len(texts)))
+
+    class Handler(socketserver.BaseRequestHandler):
+        def handle(self):
+            while True:
+                try:
+                    (size,) = _LENGTH.unpack(_recv_exact(self.request, _LENGTH.size))
+                    text = _recv_exact(self.request, size).decode("utf-8")
+                except ConnectionError:
+                    return
+                data = array("f", batcher.encode(text)).tobytes()
+                self.request.sendall(_LENGTH.pack(len(data)) + data)
+
+    if os.path.exists(socket_path):
+        os.unlink(socket_path)
+
+    server = socketserver.ThreadingUnixStreamServer(socket_path, Handler)
+    server.daemon_threads = True
+    print(f"✅ Embedding service listening on {socket_path} "
+          f"(max batch {batcher.max_batch}, wait {batcher.max_wait * 1000:.0f} ms)")
+    try:
+        server.serve_forever()
+    finally:
+        os.unlink(socket_path)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Shared micro-batching embedding service.")
+    parser.add_argument("--socket", default=EMBED_SOCKET or "/tmp/satyam-embed.sock")
+    args = parser.parse_args()
+    serve(args.socket)
@@ -0,0 +1,45 @@
+import json
+import sys
+
+from rewrite_gate import classify
+
+# Labelled follow-ups: does the query need the conversation to make sense?
+CASES_FILE = "rewrite_gate_cases.json"
+MAX_FALSE_SKIP_RATE = 0.05 # Skipping a context-dependent query retrieves for the wrong subject
+
+with open(CASES_FILE) as f:
+    cases = json.load(f)
+
+false_skips = []
+false_rewrites = []
+skipped = 0
+
+for case in cases:
+    decision, reason = classify(case["query"], case["history"])
+    if not decision:
+        skipped += 1
+    if case["needs_rewrite"] and not decision:
+        false_skips.append((case["query"], reason))
+    elif not case["needs_rewrite"] and decision:
+        false_rewrites.append((case["query"], reason))
+
+dependent = sum(1 for case in cases if case["needs_rewrite"])
+self_contained = len(cases) - dependent
+
+print(f"Cases: {len(cases)} ({dependent} context-dependent, {self_contained} self-contained)")
+print(f"Skip rate: {skipped / len(cases):.0%}")
+
+for query, reason in false_skips:
+    print(f"❌ FALSE SKIP: '{query}' ({reason})")
+for query, reason in false_rewrites:
+    print(f"⚠️ Unneeded rewrite: '{query}' ({reason})")
+
+false_skip_rate = len(false_skips) / dependent if dependent else 0.0
+print(f"False-skip rate: {false_skip_rate:.1%} | Unneeded-rewrite rate: "
+      f"{len(false_rewrites) / self_contained if self_contained else 0.0:.1%}")
+
+if false_skip_rate > MAX_FALSE_SKIP_RATE:
+    print(f"❌ FAILURE: False-skip rate above {MAX_FALSE_SKIP_RATE:.0%}.")
+    sys.exit(1)
+
+print("✅ SUCCESS: False-skip rate within limit.")
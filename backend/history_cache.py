@@ -0,0 +1,196 @@
+# history_cache.py
+
+import os
+import time
+import uuid
+import tempfile
+import threading
+from contextlib import contextmanager
+from collections import OrderedDict, deque
+
+try:
+    import fcntl
+except ImportError: # Windows: single-process dev server, the thread lock is enough
+    fcntl = None
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# ============================
+#  RECENT-HISTORY CACHE (PER WORKER)
+# ============================
+# Active chat sessions keep their owner, rolling summary and last few
+# messages in memory, so a follow-up turn needs no DB reads for context.
+# Entries are filled when /rag saves a turn (or on the first miss), and
+# sessions are evicted LRU.
+#
+# Other workers learn about writes through a marker file per session: every
+# write or delete gives it a new token, and a cached entry is only used
+# while the marker is unchanged since the entry was last synced. Checking
+# the marker and writing the new token happen under a file lock shared by
+# all workers, so a write from another worker can't land in between.
+# Markers untouched for longer than the TTL are pruned: every entry that
+# could still match them has expired by then.
+# HISTORY_CACHE_TTL_SECONDS bounds staleness when workers don't share a
+# filesystem.
+
+HISTORY_CACHE_SESSIONS = int(os.getenv("HISTORY_CACHE_SESSIONS", "1000"))
+HISTORY_CACHE_MESSAGES = int(os.getenv("HISTORY_CACHE_MESSAGES", "6"))
+HISTORY_CACHE_TTL_SECONDS = float(os.getenv("HISTORY_CACHE_TTL_SECONDS", "300"))
+HISTORY_CACHE_DIR = os.getenv("HISTORY_CACHE_DIR", os.path.join(tempfile.gettempdir(), "satyam-history-cache"))
+
+
+class SessionHistory:
+    def __init__(self, owner_id, summary: str = "", summary_last_id: int = 0, messages=()):
+        self.owner_id = owner_id
+        self.summary = summary
+        self.summary_last_id = summary_last_id
+        self.messages = deque(messages, maxlen=HISTORY_CACHE_MESSAGES) # (message id, formatted text)
+        self.loaded_at = time.monotonic()
+        self.marker = None
+
+
+_entries = OrderedDict()
+_lock = threading.Lock()
+_lock_file = None
+_last_prune = time.monotonic()
+
+
+@contextmanager
+def _locked():
+    """This worker's thread lock, plus the cross-worker lock on the cache dir."""
+    global _lock_file
+    with _lock:
+        if fcntl is None:
+            yield
+            return
+        if _lock_file is None:
+            os.makedirs(HISTORY_CACHE_DIR, exist_ok=True)
+            _lock_file = open(os.path.join(HISTORY_CACHE_DIR, ".lock"), "a")
+        fcntl.flock(_lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(_lock_file, fcntl.LOCK_UN)
+
+
+def _marker_path(session_id: int):
+    return os.path.join(HISTORY_CACHE_DIR, str(session_id))
+
+
+def _marker(session_id: int):
+    try:
+        with open(_marker_path(session_id)) as f:
+            return f.read()
+    except FileNotFoundError:
+        return None
+
+
+def _touch(session_id: int):
+    """Gives the marker a new random token (mtimes are too coarse to tell close writes apart)."""
+    os.makedirs(HISTORY_CACHE_DIR, exist_ok=True)
+    token = uuid.uuid4().hex
+    tmp_path = f"{_marker_path(session_id)}.{token}"
+    with open(tmp_path, "w") as f:
+        f.write(token)
+    os.replace(tmp_path, _marker_path(session_id))
+    return token
+
+
+def _prune_markers():
+    """Removes markers older than the TTL, at most once per TTL (call under _locked)."""
+    global _last_prune
+    now = time.monotonic()
+    if now - _last_prune < HISTORY_CACHE_TTL_SECONDS:
+        return
+    _last_prune = now
+    cutoff = time.time() - HISTORY_CACHE_TTL_SECONDS
+    for name in os.listdir(HISTORY_CACHE_DIR):
+        path = os.path.join(HISTORY_CACHE_DIR, name)
+        try:
+            if name.isdigit() and os.path.getmtime(path) < cutoff:
+                os.remove(path)
+        except FileNotFoundError:
+            pass
+
+
+def _fresh(entry: SessionHistory, session_id: int):
+    return (time.monotonic() - entry.loaded_at < HISTORY_CACHE_TTL_SECONDS
+            and entry.marker == _marker(session_id))
+
+
+def get(session_id: int):
+    """The cached entry if it is still in sync with the DB, else None (reads the marker file)."""
+    with _lock:
+        entry = _entries.get(session_id)
+        if entry is not None and not _fresh(entry, session_id):
+            del _entries[session_id]
+            entry = None
+        if entry is not None:
+            _entries.move_to_end(session_id)
+        return entry
+
+
+def put(session_id: int, entry: SessionHistory, marker):
+    """Stores an entry loaded from the DB; `marker` is the one read before loading."""
+    entry.marker = marker
+    with _lock:
+        _entries[session_id] = entry
+        _entries.move_to_end(session_id)
+        while len(_entries) > HISTORY_CACHE_SESSIONS:
+            _entries.popitem(last=False)
+
+
+def current_marker(session_id: int):
+    return _marker(session_id)
+
+
+def append(session_id: int, owner_id, messages: list, created: bool = False):
+    """
+    Records messages this worker just committed. `created` means the session
+    is new, so the messages are its whole history and can seed an entry.
+    Blocking file I/O: call it off the event loop.
+    """
+    with _locked():
+        entry = _entries.get(session_id)
+        # Someone else wrote since our last sync: our copy can't be patched
+        if entry is not None and entry.marker != _marker(session_id):
+            del _entries[session_id]
+            entry = None
+        if entry is None and created:
+            entry = SessionHistory(owner_id)
+            _entries[session_id] = entry
+        if entry is not None:
+            entry.messages.extend(messages)
+            _entries.move_to_end(session_id)
+        marker = _touch(session_id)
+        if entry is not None:
+            entry.marker = marker
+        while len(_entries) > HISTORY_CACHE_SESSIONS:
+            _entries.popitem(last=False)
+        _prune_markers()
+
+
+def set_summary(session_id: int, summary: str, last_message_id: int):
+    """Records a summary refresh this worker just committed."""
+    with _locked():
+        entry = _entries.get(session_id)
+        if entry is not None and entry.marker != _marker(session_id):
+            del _entries[session_id]
+            entry = None
+        if entry is not None:
+            entry.summary = summary
+            entry.summary_last_id = last_message_id
+        marker = _touch(session_id)
+        if entry is not None:
+            entry.marker = marker
+
+
+def invalidate(session_id: int):
+    """Drops the session here and, via its marker, in every other worker (blocking file I/O)."""
+    with _locked():
+        _entries.pop(session_id, None)
+        # A fresh token, not a removed file: entries loaded while no marker
+        # existed (marker None) must not match afterwards
+        _touch(session_id)
+
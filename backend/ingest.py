@@ -1,27 +1,43 @@
 import os
 import glob
+import json
+import bisect
+import hashlib
+from collections import Counter
 from dotenv import load_dotenv
 from pinecone import Pinecone
 from sentence_transformers import SentenceTransformer
 import PyPDF2
 
+import docstore
+import ann_index
+import dedup
+import domain_gate
+
 # Load environment variables
 load_dotenv()
 
 PINECONE_API_KEY = os.getenv("PINECONE_API_KEY")
 INDEX_NAME = os.getenv("PINECONE_INDEX_NAME", "legal-index")
+VECTOR_BACKEND = os.getenv("VECTOR_BACKEND", "pinecone")
+
+EMBEDDING_MODEL = "sentence-transformers/all-MiniLM-L6-v2"
+CHUNK_SIZE = 500
+CHUNK_OVERLAP = 250
 
 def ingest_pdfs():
     print("🚀 Starting Ingestion Process...")
     
-    # 1. Initialize Pinecone
-    pc = Pinecone(api_key=PINECONE_API_KEY)
-    index = pc.Index(INDEX_NAME)
-    print(f"✅ Connected to Index: {INDEX_NAME}")
+    # 1. Initialize Pinecone (skipped when serving from the local ANN index only)
+    index = None
+    if VECTOR_BACKEND != "local":
+        pc = Pinecone(api_key=PINECONE_API_KEY)
+        index = pc.Index(INDEX_NAME)
+        print(f"✅ Connected to Index: {INDEX_NAME}")
 
     # 2. Load Embedding Model
     print("🔄 Loading embedding model...")
-    model = SentenceTransformer("sentence-transformers/all-MiniLM-L6-v2")
+    model = SentenceTransformer(EMBEDDING_MODEL)
 
     # 3. Find Documents (PDFs and TXTs)
     pdf_files = glob.glob("*.pdf")
@@ -35,69 +51,146 @@ def ingest_pdfs():
 
     print(f"found {len(all_files)} files: {all_files}")
 
+    # Index version: changes whenever the source files, chunking or dedup change.
+    # Precomputed answers (precompute.py) are recorded against it.
+    version_hash = hashlib.sha256(
+        f"{EMBEDDING_MODEL}|{CHUNK_SIZE}|{CHUNK_OVERLAP}|dedup={dedup.DEDUP_THRESHOLD}".encode()
+    )
+    for file_path in sorted(all_files):
+        version_hash.update(file_path.encode())
+        with open(file_path, "rb") as f:
+            version_hash.update(f.read())
+    index_version = version_hash.hexdigest()[:16]
+
+    # 4. Extract and chunk every file first, so duplicates across files
+    # can be collapsed before anything is embedded
+    chunks = []
+    boilerplate_lines = 0
+
     for file_path in all_files:
         print(f"\n📄 Processing: {file_path}")
         
         try:
-            input_text = ""
-            
-            # Read File based on extension
+            # Read File based on extension (PDFs page by page)
             if file_path.endswith('.pdf'):
                 reader = PyPDF2.PdfReader(file_path)
-                for page in reader.pages:
-                    input_text += page.extract_text() + "\n"
+                pages = [page.extract_text() or "" for page in reader.pages]
+                pages, removed = dedup.strip_boilerplate(pages)
+                boilerplate_lines += removed
+                if removed:
+                    print(f"   - Stripped {removed} repeated header/footer lines.")
             elif file_path.endswith('.txt'):
                 with open(file_path, 'r', encoding='utf-8') as f:
-                    input_text = f.read()
+                    pages = [f.read()]
+            else:
+                continue
+
+            # Where each page starts in the joined text, to tag chunks with their page
+            page_starts = []
+            input_text = ""
+            for page in pages:
+                page_starts.append(len(input_text))
+                input_text += page + "\n"
             
             print(f"   - Extracted {len(input_text)} characters.")
             
             # Simple Chunking (Overlapping windows)
             # Reduced size to capture specific sections better
-            chunk_size = 500
-            overlap = 250
-            chunks = []
+            chunk_size = CHUNK_SIZE
+            overlap = CHUNK_OVERLAP
+            file_chunks = 0
             
             for i in range(0, len(input_text), chunk_size - overlap):
                 chunk = input_text[i:i + chunk_size]
                 if len(chunk) > 50: # Filter tiny chunks (lowered from 100 for shorter text files)
-                    chunks.append(chunk)
-
-            print(f"   - Created {len(chunks)} chunks.")
-
-            # Embed and Upsert
-            vectors = []
-            for i, chunk in enumerate(chunks):
-                # Metadata
-                meta = {
-                    "text": chunk,
-                    "source": file_path,
-                    "chunk_id": i
-                }
-                
-                # Create ID
-                v_id = f"{file_path}_{i}"
-                
-                # Embed
-                embedding = model.encode(chunk).tolist()
-                
-                vectors.append((v_id, embedding, meta))
-
-            if not vectors:
-                print(f"⚠️ No valid chunks found for {file_path}")
-                continue
+                    chunks.append({
+                        "id": f"{file_path}_{file_chunks}",
+                        "text": chunk,
+                        "source": file_path,
+                        "chunk_id": file_chunks,
+                        "page": bisect.bisect_right(page_starts, i) if file_path.endswith('.pdf') else None,
+                    })
+                    file_chunks += 1
 
-            # Batch Upsert (100 at a time)
-            batch_size = 100
-            for i in range(0, len(vectors), batch_size):
-                batch = vectors[i:i + batch_size]
-                index.upsert(vectors=batch)
-                print(f"   - Upserted batch {i//batch_size + 1}/{(len(vectors)//batch_size)+1}")
-                
-            print(f"✅ Finished {file_path}")
+            print(f"   - Created {file_chunks} chunks.")
+            if not file_chunks:
+                print(f"⚠️ No valid chunks found for {file_path}")
 
         except Exception as e:
             print(f"❌ Error processing {file_path}: {e}")
 
+    if not chunks:
+        return
+
+    # 5. Collapse near-duplicates: one canonical chunk per group, the others
+    # recorded as alternate sources. The longest text wins; on a tie, the
+    # bigger document (the Act itself rather than a guide quoting it).
+    print(f"\n🔎 Looking for near-duplicates among {len(chunks)} chunks...")
+    source_sizes = Counter(c["source"] for c in chunks)
+    canonical = []
+    dropped_ids = []
+    for group in dedup.near_duplicates([c["text"] for c in chunks]):
+        members = [chunks[i] for i in group]
+        keep = max(members, key=lambda c: (len(c["text"]), source_sizes[c["source"]]))
+        keep["alt_sources"] = [
+            {"source": c["source"], "chunk_id": c["chunk_id"], "page": c["page"]}
+            for c in members if c is not keep
+        ]
+        canonical.append(keep)
+        dropped_ids.extend(c["id"] for c in members if c is not keep)
+
+    stats = {
+        "chunks": len(chunks),
+        "indexed": len(canonical),
+        "duplicates_collapsed": len(dropped_ids),
+        "duplicate_groups": sum(1 for c in canonical if c["alt_sources"]),
+        "boilerplate_lines_removed": boilerplate_lines,
+        "compaction": round(1 - len(canonical) / len(chunks), 4),
+    }
+    print(f"✅ Compaction: {stats['chunks']} chunks -> {stats['indexed']} indexed "
+          f"({stats['duplicates_collapsed']} duplicates in {stats['duplicate_groups']} groups, "
+          f"{stats['compaction']:.1%} smaller; {boilerplate_lines} boilerplate lines stripped)")
+
+    # 6. Embed and store
+    # Chunk text goes to the local docstore; Pinecone only keeps
+    # light metadata so queries don't ship the text back. docstore.db has to
+    # be deployed with the app (see README; app startup checks for it).
+    print(f"🔄 Embedding {len(canonical)} chunks...")
+    all_ids = [c["id"] for c in canonical]
+    all_embeddings = model.encode([c["text"] for c in canonical], batch_size=64).tolist()
+
+    docstore.put_chunks(
+        (c["id"], c["text"], c["source"], c["chunk_id"], c["page"], c["alt_sources"]) for c in canonical
+    )
+    # Collapsed duplicates may still be there from an earlier run
+    docstore.delete_chunks(dropped_ids)
+    print(f"   - Stored {len(canonical)} chunks in docstore ({docstore.DOCSTORE_PATH})")
+
+    # Batch Upsert (100 at a time)
+    if index:
+        vectors = [
+            (c["id"], embedding, {"source": c["source"], "chunk_id": c["chunk_id"]})
+            for c, embedding in zip(canonical, all_embeddings)
+        ]
+        batch_size = 100
+        for i in range(0, len(vectors), batch_size):
+            batch = vectors[i:i + batch_size]
+            index.upsert(vectors=batch)
+            print(f"   - Upserted batch {i//batch_size + 1}/{(len(vectors)//batch_size)+1}")
+        for i in range(0, len(dropped_ids), batch_size):
+            index.delete(ids=dropped_ids[i:i + batch_size])
+
+    # 7. Build the local quantized ANN index (memory-mapped by rag_chain)
+    info = ann_index.build_index(all_ids, all_embeddings)
+    print(f"✅ Built local ANN index in {ann_index.ANN_INDEX_DIR}/: {info}")
+
+    centroids = domain_gate.build_centroids(all_embeddings)
+    print(f"✅ Saved {centroids} domain centroids to {domain_gate.DOMAIN_CENTROIDS_PATH} "
+          f"(run calibrate_domain_gate.py to refresh thresholds)")
+
+    docstore.set_meta("ingest_stats", json.dumps(stats))
+    docstore.set_meta("index_version", index_version)
+    print(f"✅ Index version: {index_version} (run precompute.py to refresh cached answers)")
+
 if __name__ == "__main__":
     ingest_pdfs()
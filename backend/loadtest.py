@@ -0,0 +1,472 @@
+# loadtest.py
+
+import os
+import re
+import sys
+import json
+import glob
+import time
+import random
+import shutil
+import argparse
+import tempfile
+import threading
+import subprocess
+import urllib.request
+import urllib.error
+import urllib.parse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# ============================
+#  LOAD TEST HARNESS
+# ============================
+# Starts app.py against local stand-ins (no OpenAI quota, no Pinecone):
+#   - a fake OpenAI-compatible server (latency, token streaming, injected 429s)
+#   - the local ANN index + docstore, built from the repo's source files
+#   - a throwaway SQLite database
+# then replays a mix of /rag, /chat/history and /auth/login traffic and
+# prints throughput, p50/p99 latency and error rates as JSON.
+#
+#     python loadtest.py --concurrency 16 --duration 60 --output report.json
+
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Keys that must not come from backend/.env during a load test
+# (providers.py loads .env with override=True).
+_UNSAFE_DOTENV_KEYS = {
+    "DATABASE_URL", "VECTOR_BACKEND", "OPENAI_BASE_URL", "OPENAI_API_KEY",
+    "PROVIDER_MODE", "PROVIDER_CASSETTE_DIR", "DOCSTORE_PATH", "ANN_INDEX_DIR",
+}
+
+DEFAULT_MIX = {
+    "rag_guest": 30,
+    "rag_auth": 20,
+    "rag_auth_session": 30,
+    "chat_history": 15,
+    "auth_login": 5,
+}
+
+QUERIES = [
+    "What is Section 302?",
+    "What is Section 420 IPC?",
+    "Explain section 498A",
+    "What is the punishment for theft?",
+    "How do I file an RTI online?",
+    "What are the time limits for an RTI reply?",
+    "Can police arrest without a warrant?",
+    "What is Article 21 of the Constitution?",
+    "Is hacking a crime under the IT Act?",
+    "Who won the cricket world cup?",
+    "302",
+]
+
+FOLLOW_UPS = [
+    "What is the punishment?",
+    "Tell me more",
+    "Is it bailable?",
+    "What if it was an attempt?",
+    "How do I appeal?",
+]
+
+
+# ============================
+#  FAKE OPENAI SERVER
+# ============================
+
+class FakeOpenAIStats:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.rate_limited = 0
+        self.streamed = 0
+
+    def to_dict(self):
+        return {"requests": self.requests, "rate_limited": self.rate_limited, "streamed": self.streamed}
+
+
+def _fake_completion_text(messages, response_format=None):
+    system = messages[0].get("content", "") if messages else ""
+    last = messages[-1].get("content", "") if messages else ""
+
+    if response_format and response_format.get("type") == "json_object":
+        return json.dumps({
+            "mode": "verified",
+            "sufficient": True,
+            "answer": "Under the retrieved provision, the offence is punishable as stated in the statute text. "
+                      "This is a simulated answer from the load-test server.",
+            "sources_used": [1],
+        })
+
+    if "REWRITER" in system:
+        match = re.search(r"CURRENT QUERY:\s*(.+)", last)
+        return match.group(1).strip() if match else "What is Section 302 IPC?"
+    if "SUMMARIZER" in system:
+        return "The user asked about Indian criminal law provisions and their punishments."
+    return (
+        "Under the retrieved provision, the offence is punishable as stated in the statute text. "
+        "This is a simulated answer from the load-test server.\nSOURCES_USED: ipc_act.txt"
+    )
+
+
+def make_fake_openai_handler(latency_ms, jitter_ms, token_ms, error_rate, stats):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, *args):
+            pass
+
+        def _send_json(self, status, body):
+            data = json.dumps(body).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            try:
+                self.wfile.write(data)
+            except (BrokenPipeError, ConnectionResetError):
+                pass # Client gave up (request deadline / per-call timeout)
+
+        def do_POST(self):
+            length = int(self.headers.get("Content-Length", 0))
+            request = json.loads(self.rfile.read(length) or b"{}")
+
+            with stats.lock:
+                stats.requests += 1
+
+            if not self.path.endswith("/chat/completions"):
+                self._send_json(404, {"error": {"message": f"Not supported by fake server: {self.path}"}})
+                return
+
+            if random.random() < error_rate:
+                with stats.lock:
+                    stats.rate_limited += 1
+                self._send_json(429, {"error": {"message": "Rate limit reached (injected)", "type": "requests", "code": "rate_limit_exceeded"}})
+                return
+
+            time.sleep(max(0.0, random.gauss(latency_ms, jitter_ms)) / 1000)
+
+            messages = request.get("messages", [])
+            text = _fake_completion_text(messages, request.get("response_format"))
+            tokens = re.findall(r"\S+\s*", text)
+            prompt_tokens = sum(len(m.get("content", "")) for m in messages) // 4
+            model = request.get("model", "gpt-3.5-turbo")
+            created = int(time.time())
+
+            if request.get("stream"):
+                with stats.lock:
+                    stats.streamed += 1
+                self.send_response(200)
+                self.send_header("Content-Type", "text/event-stream")
+                self.send_header("Connection", "close")
+                self.end_headers()
+                for token in tokens:
+                    time.sleep(token_ms / 1000)
+                    chunk = {
+                        "id": "chatcmpl-fake", "object": "chat.completion.chunk", "created": created, "model": model,
+                        "choices": [{"index": 0, "delta": {"content": token}, "finish_reason": None}],
+                    }
+                    self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode())
+                    self.wfile.flush()
+                self.wfile.write(b"data: [DONE]\n\n")
+                self.close_connection = True
+                return
+
+            time.sleep(token_ms * len(tokens) / 1000)
+            self._send_json(200, {
+                "id": "chatcmpl-fake",
+                "object": "chat.completion",
+                "created": created,
+                "model": model,
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": text}, "finish_reason": "stop"}],
+                "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": len(tokens), "total_tokens": prompt_tokens + len(tokens)},
+            })
+
+    return Handler
+
+
+def start_fake_openai(port, latency_ms, jitter_ms, token_ms, error_rate):
+    stats = FakeOpenAIStats()
+    handler = make_fake_openai_handler(latency_ms, jitter_ms, token_ms, error_rate, stats)
+    server = ThreadingHTTPServer(("127.0.0.1", port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, stats
+
+
+# ============================
+#  APP UNDER TEST
+# ============================
+
+def check_dotenv():
+    path = os.path.join(BACKEND_DIR, ".env")
+    if not os.path.exists(path):
+        return
+    with open(path) as f:
+        keys = {line.split("=", 1)[0].strip() for line in f if "=" in line and not line.lstrip().startswith("#")}
+    unsafe = keys & _UNSAFE_DOTENV_KEYS
+    if unsafe:
+        sys.exit(f"❌ backend/.env sets {sorted(unsafe)}; providers.py would override the load-test environment with them. "
+                 f"Move them out of .env before running the load test.")
+
+
+def build_local_index(workdir, env):
+    """Runs ingest.py in VECTOR_BACKEND=local mode on copies of the source files."""
+    for path in glob.glob(os.path.join(BACKEND_DIR, "*.pdf")) + glob.glob(os.path.join(BACKEND_DIR, "*.txt")):
+        shutil.copy(path, workdir)
+    print("🔄 Building local vector index...")
+    subprocess.run([sys.executable, os.path.join(BACKEND_DIR, "ingest.py")], cwd=workdir, env=env, check=True,
+                   stdout=subprocess.DEVNULL)
+
+
+def start_app(workdir, env, port, workers):
+    cmd = [sys.executable, "-m", "uvicorn", "app:app", "--app-dir", BACKEND_DIR,
+           "--host", "127.0.0.1", "--port", str(port), "--workers", str(workers), "--log-level", "warning"]
+    log = open(os.path.join(workdir, "app.log"), "w")
+    return subprocess.Popen(cmd, cwd=workdir, env=env, stdout=log, stderr=subprocess.STDOUT)
+
+
+def wait_until_ready(base_url, proc, timeout=300):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if proc.poll() is not None:
+            raise RuntimeError("App exited during startup (see app.log)")
+        try:
+            with urllib.request.urlopen(f"{base_url}/", timeout=2) as resp:
+                if resp.status == 200:
+                    return
+        except Exception:
+            time.sleep(0.5)
+    raise RuntimeError("App did not become ready in time")
+
+
+# ============================
+#  WORKLOAD
+# ============================
+
+def http(method, url, body=None, headers=None, form=False, timeout=120):
+    headers = dict(headers or {})
+    data = None
+    if body is not None:
+        if form:
+            data = urllib.parse.urlencode(body).encode()
+            headers["Content-Type"] = "application/x-www-form-urlencoded"
+        else:
+            data = json.dumps(body).encode()
+            headers["Content-Type"] = "application/json"
+    req = urllib.request.Request(url, data=data, headers=headers, method=method)
+    try:
+        with urllib.request.urlopen(req, timeout=timeout) as resp:
+            return resp.status, json.loads(resp.read() or b"null")
+    except urllib.error.HTTPError as e:
+        return e.code, None
+
+
+class VirtualUser:
+    def __init__(self, email, password, token):
+        self.email = email
+        self.password = password
+        self.token = token
+        self.session_id = None
+
+    @property
+    def headers(self):
+        return {"Authorization": f"Bearer {self.token}"}
+
+
+def create_users(base_url, count):
+    users = []
+    run_id = int(time.time())
+    for i in range(count):
+        email = f"loadtest_{run_id}_{i}@example.com"
+        status, body = http("POST", f"{base_url}/auth/signup", {"name": f"Load Test {i}", "email": email, "password": "loadtest"})
+        if status != 200:
+            raise RuntimeError(f"Signup failed with status {status}")
+        users.append(VirtualUser(email, "loadtest", body["access_token"]))
+    return users
+
+
+def run_scenario(name, base_url, user):
+    if name == "rag_guest":
+        return http("POST", f"{base_url}/rag", {"query": random.choice(QUERIES)})
+
+    if name == "rag_auth":
+        status, body = http("POST", f"{base_url}/rag", {"query": random.choice(QUERIES)}, user.headers)
+        if status == 200 and body:
+            user.session_id = body.get("session_id")
+        return status, body
+
+    if name == "rag_auth_session":
+        if not user.session_id:
+            return run_scenario("rag_auth", base_url, user)
+        query = random.choice(FOLLOW_UPS + QUERIES)
+        return http("POST", f"{base_url}/rag", {"query": query, "session_id": user.session_id}, user.headers)
+
+    if name == "chat_history":
+        return http("GET", f"{base_url}/chat/history", headers=user.headers)
+
+    if name == "auth_login":
+        return http("POST", f"{base_url}/auth/login", {"username": user.email, "password": user.password}, form=True)
+
+    raise ValueError(f"Unknown scenario: {name}")
+
+
+def percentile(values, pct):
+    if not values:
+        return None
+    ordered = sorted(values)
+    k = min(len(ordered) - 1, max(0, int(round(pct / 100 * (len(ordered) - 1)))))
+    return ordered[k]
+
+
+def summarize(samples, elapsed):
+    def stats(rows):
+        latencies = [r[1] for r in rows]
+        errors = sum(1 for r in rows if not r[2])
+        return {
+            "requests": len(rows),
+            "errors": errors,
+            "error_rate": round(errors / len(rows), 4) if rows else 0.0,
+            "throughput_rps": round(len(rows) / elapsed, 2) if elapsed else 0.0,
+            "latency_ms": {
+                "mean": round(sum(latencies) / len(latencies), 1) if latencies else None,
+                "p50": round(percentile(latencies, 50), 1) if latencies else None,
+                "p90": round(percentile(latencies, 90), 1) if latencies else None,
+                "p99": round(percentile(latencies, 99), 1) if latencies else None,
+                "max": round(max(latencies), 1) if latencies else None,
+            },
+        }
+
+    by_scenario = {}
+    for row in samples:
+        by_scenario.setdefault(row[0], []).append(row)
+
+    return {
+        "duration_s": round(elapsed, 2),
+        "overall": stats(samples),
+        "scenarios": {name: stats(rows) for name, rows in sorted(by_scenario.items())},
+    }
+
+
+def run_load(base_url, users, mix, concurrency, duration, max_requests):
+    names = list(mix)
+    weights = [mix[n] for n in names]
+    samples = []
+    lock = threading.Lock()
+    stop_at = time.time() + duration
+    issued = [0]
+
+    def worker(worker_id):
+        user = users[worker_id % len(users)]
+        while time.time() < stop_at:
+            with lock:
+                if max_requests and issued[0] >= max_requests:
+                    return
+                issued[0] += 1
+            name = random.choices(names, weights)[0]
+            t0 = time.perf_counter()
+            try:
+                status, _ = run_scenario(name, base_url, user)
+                ok = 200 <= status < 300
+            except Exception:
+                ok = False
+            latency = (time.perf_counter() - t0) * 1000
+            with lock:
+                samples.append((name, latency, ok))
+
+    threads = [threading.Thread(target=worker, args=(i,), daemon=True) for i in range(concurrency)]
+    started = time.time()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return summarize(samples, time.time() - started)
+
+
+# ============================
+#  MAIN
+# ============================
+
+def parse_mix(text):
+    if not text:
+        return DEFAULT_MIX
+    mix = {}
+    for part in text.split(","):
+        name, weight = part.split("=")
+        if name not in DEFAULT_MIX:
+            raise SystemExit(f"Unknown scenario '{name}'. Choose from: {', '.join(DEFAULT_MIX)}")
+        mix[name] = float(weight)
+    return mix
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test app.py against local OpenAI / vector store stand-ins.")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--duration", type=float, default=30, help="seconds")
+    parser.add_argument("--max-requests", type=int, default=0, help="stop after N requests (0 = duration only)")
+    parser.add_argument("--users", type=int, default=8, help="authenticated virtual users")
+    parser.add_argument("--workers", type=int, default=1, help="uvicorn workers")
+    parser.add_argument("--mix", default="", help="e.g. rag_guest=30,rag_auth_session=50,chat_history=20")
+    parser.add_argument("--llm-latency-ms", type=float, default=800)
+    parser.add_argument("--llm-jitter-ms", type=float, default=200)
+    parser.add_argument("--llm-token-ms", type=float, default=5, help="per generated token")
+    parser.add_argument("--llm-429-rate", type=float, default=0.0, help="fraction of LLM calls answered with 429")
+    parser.add_argument("--app-port", type=int, default=8765)
+    parser.add_argument("--llm-port", type=int, default=8766)
+    parser.add_argument("--index-dir", default="", help="reuse a workdir that already has docstore.db + ann_index/")
+    parser.add_argument("--output", default="", help="also write the JSON report here")
+    args = parser.parse_args()
+
+    check_dotenv()
+    mix = parse_mix(args.mix)
+
+    workdir = args.index_dir or tempfile.mkdtemp(prefix="satyam-loadtest-")
+    env = dict(os.environ)
+    env.pop("DATABASE_URL", None)  # SQLite in the workdir, never the real database
+    env.update({
+        "OPENAI_API_KEY": "sk-loadtest",
+        "OPENAI_BASE_URL": f"http://127.0.0.1:{args.llm_port}/v1",
+        "VECTOR_BACKEND": "local",
+        "PINECONE_API_KEY": "",
+    })
+
+    llm_server, llm_stats = start_fake_openai(args.llm_port, args.llm_latency_ms, args.llm_jitter_ms,
+                                              args.llm_token_ms, args.llm_429_rate)
+    app_proc = None
+    try:
+        if not os.path.exists(os.path.join(workdir, "ann_index")):
+            build_local_index(workdir, env)
+
+        base_url = f"http://127.0.0.1:{args.app_port}"
+        print(f"🚀 Starting app ({args.workers} worker(s)) in {workdir}...")
+        app_proc = start_app(workdir, env, args.app_port, args.workers)
+        wait_until_ready(base_url, app_proc)
+
+        users = create_users(base_url, max(1, args.users))
+        print(f"🔥 Running {args.duration:.0f}s at concurrency {args.concurrency}...")
+        report = run_load(base_url, users, mix, args.concurrency, args.duration, args.max_requests)
+        report["config"] = {
+            "concurrency": args.concurrency,
+            "workers": args.workers,
+            "mix": mix,
+            "llm_latency_ms": args.llm_latency_ms,
+            "llm_token_ms": args.llm_token_ms,
+            "llm_429_rate": args.llm_429_rate,
+        }
+        report["fake_openai"] = llm_stats.to_dict()
+
+        output = json.dumps(report, indent=4)
+        print(output)
+        if args.output:
+            with open(args.output, "w") as f:
+                f.write(output)
+    finally:
+        if app_proc:
+            app_proc.terminate()
+            app_proc.wait(timeout=30)
+        llm_server.shutdown()
+        if not args.index_dir:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
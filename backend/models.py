@@ -30,3 +30,21 @@ class ChatMessage(SQLModel, table=True):
     created_at: datetime = Field(default_factory=datetime.utcnow)
     
     session: Optional[ChatSession] = Relationship(back_populates="messages")
+
+class ChatSummary(SQLModel, table=True):
+    session_id: int = Field(foreign_key="chatsession.id", primary_key=True)
+    summary: str = Field(default="") # Rolling summary of the conversation so far
+    last_message_id: int = Field(default=0) # Last ChatMessage.id folded into the summary
+    updated_at: datetime = Field(default_factory=datetime.utcnow)
+
+class TokenUsage(SQLModel, table=True):
+    id: Optional[int] = Field(default=None, primary_key=True)
+    created_at: datetime = Field(default_factory=datetime.utcnow)
+    day: str = Field(index=True) # "YYYY-MM-DD" (UTC), for per-day aggregation
+    user_id: Optional[int] = Field(default=None, index=True) # None for guests / batch jobs
+    path: str = Field(index=True) # Which LLM call: rewrite, answer_verified, answer_general, summary, ...
+    model: str
+    prompt_tokens: int = Field(default=0)
+    completion_tokens: int = Field(default=0)
+    latency_ms: float = Field(default=0)
+    cost_usd: float = Field(default=0)
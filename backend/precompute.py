@@ -0,0 +1,207 @@
+# precompute.py
+
+import os
+import re
+import json
+import sqlite3
+import threading
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from dotenv import load_dotenv
+
+import docstore
+
+load_dotenv()
+
+# ============================
+#  PRECOMPUTED ANSWERS
+# ============================
+# Our most common queries are the provisions we index ourselves: every
+# section in ipc_act.txt and every part of rti_filing_guide.txt.
+# Run this after ingest.py:
+#
+#     python precompute.py
+#
+# It generates a verified answer per provision (bounded LLM concurrency) and
+# stores it against the current index version. /rag serves these directly
+# when a query canonicalizes to one of them.
+
+PRECOMPUTED_PATH = os.getenv("PRECOMPUTED_PATH", "precomputed.db")
+PRECOMPUTE_CONCURRENCY = int(os.getenv("PRECOMPUTE_CONCURRENCY", "4"))
+
+IPC_FILE = "ipc_act.txt"
+RTI_FILE = "rti_filing_guide.txt"
+
+_conn = None
+_lock = threading.Lock()
+
+
+def _connect():
+    global _conn
+    if _conn is None:
+        _conn = sqlite3.connect(PRECOMPUTED_PATH, check_same_thread=False)
+        _conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS answers (
+                key TEXT NOT NULL,
+                index_version TEXT NOT NULL,
+                query TEXT NOT NULL,
+                result TEXT NOT NULL,
+                created_at TEXT NOT NULL,
+                PRIMARY KEY (key, index_version)
+            )
+            """
+        )
+        _conn.commit()
+    return _conn
+
+
+# ============================
+#  CANONICAL QUERIES
+# ============================
+
+# Words that don't change which provision a question is about
+_FILLER = {
+    "what", "whats", "is", "are", "the", "a", "an", "of", "in", "under", "about",
+    "explain", "tell", "me", "please", "define", "meaning", "describe", "give",
+    "how", "to", "do", "does", "i", "can", "you", "for",
+}
+_IPC_WORDS = {"ipc", "indian", "penal", "code", "section", "sec"}
+
+
+def _tokens(text: str):
+    return re.findall(r"[a-z0-9]+", text.lower())
+
+
+def canonical_query(query: str):
+    """
+    Maps a query to the key of a precomputed provision, or None.
+    Deliberately strict: anything beyond "what is Section N (IPC)" or an
+    RTI guide heading falls through to the normal pipeline.
+    """
+    tokens = _tokens(query)
+    content = [t for t in tokens if t not in _FILLER]
+
+    # "What is Section 302 IPC?", "section 498A", "Explain sec 420 of the Indian Penal Code"
+    if "section" in tokens or "sec" in tokens:
+        rest = [t for t in content if t not in _IPC_WORDS]
+        if len(rest) == 1 and re.fullmatch(r"\d+[a-z]?", rest[0]):
+            return f"ipc:section:{rest[0]}"
+        return None
+
+    # "How to file RTI online?", "RTI time limits"
+    if "rti" in content:
+        return "rti:" + " ".join(sorted(set(content)))
+
+    return None
+
+
+def load_provisions():
+    """
+    Walks the curated source files and returns [(key, question), ...].
+    """
+    provisions = []
+
+    if os.path.exists(IPC_FILE):
+        with open(IPC_FILE, "r", encoding="utf-8") as f:
+            for line in f:
+                match = re.match(r"^Section\s+(\d+[A-Za-z]?)\.", line)
+                if match:
+                    number = match.group(1)
+                    provisions.append((f"ipc:section:{number.lower()}", f"What is Section {number} IPC?"))
+
+    if os.path.exists(RTI_FILE):
+        with open(RTI_FILE, "r", encoding="utf-8") as f:
+            for line in f:
+                # Top-level guide headings, e.g. "2. HOW TO FILE RTI ONLINE"
+                match = re.match(r"^\d+\.\s+([A-Z][A-Z &?]+)$", line.strip())
+                if match:
+                    words = [w if w == "RTI" else w.lower() for w in match.group(1).rstrip("?").split()]
+                    if "RTI" not in words:
+                        words.insert(0, "RTI")
+                    question = " ".join(words)
+                    question = question[0].upper() + question[1:]
+                    provisions.append((canonical_query(question), question))
+
+    return [(key, question) for key, question in provisions if key]
+
+
+# ============================
+#  LOOKUP (used by /rag)
+# ============================
+
+def get_precomputed_answer(query: str):
+    """Returns a stored answer for the current index version, or None."""
+    key = canonical_query(query)
+    if not key or not os.path.exists(PRECOMPUTED_PATH):
+        return None
+
+    version = docstore.index_version()
+    if not version:
+        return None
+
+    with _lock:
+        row = _connect().execute(
+            "SELECT result FROM answers WHERE key = ? AND index_version = ?", (key, version)
+        ).fetchone()
+    return json.loads(row[0]) if row else None
+
+
+def store_answer(key: str, version: str, query: str, result: dict):
+    with _lock:
+        conn = _connect()
+        conn.execute(
+            "INSERT OR REPLACE INTO answers (key, index_version, query, result, created_at) VALUES (?, ?, ?, ?, ?)",
+            (key, version, query, json.dumps(result), datetime.utcnow().isoformat())
+        )
+        conn.commit()
+
+
+# ============================
+#  BATCH JOB
+# ============================
+
+def _is_verified(result: dict):
+    return result.get("mode") == "verified"
+
+
+def precompute_all(concurrency: int = PRECOMPUTE_CONCURRENCY):
+    from rag_chain import retrieve_chunks, generate_answer
+
+    version = docstore.index_version()
+    if not version:
+        print("❌ No index version found. Run ingest.py first.")
+        return
+
+    provisions = load_provisions()
+    print(f"🚀 Precomputing {len(provisions)} provisions for index {version} (concurrency={concurrency})")
+
+    def work(key, question):
+        contexts, sources, scores = retrieve_chunks(question, with_scores=True)
+        return key, question, generate_answer(question, contexts, sources, scores=scores)
+
+    stored, skipped = 0, 0
+    # The pool size bounds the number of in-flight OpenAI requests
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        futures = [pool.submit(work, key, question) for key, question in provisions]
+        for future in as_completed(futures):
+            try:
+                key, question, result = future.result()
+            except Exception as e:
+                print(f"❌ Error: {e}")
+                skipped += 1
+                continue
+
+            if _is_verified(result):
+                store_answer(key, version, question, result)
+                stored += 1
+                print(f"   ✅ {key}")
+            else:
+                skipped += 1
+                print(f"   ⚠️ {key}: not verified from the database, skipped")
+
+    print(f"✅ Stored {stored} answers, skipped {skipped}.")
+
+
+if __name__ == "__main__":
+    precompute_all()
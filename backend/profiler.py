@@ -0,0 +1,338 @@
+# profiler.py
+
+import os
+import re
+import sys
+import json
+import time
+import uuid
+import random
+import asyncio
+import threading
+import tracemalloc
+from contextvars import ContextVar
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# ============================
+#  ON-DEMAND REQUEST PROFILING
+# ============================
+# A /rag request is profiled when an admin sends `X-Profile: 1`, or when it
+# falls in PROFILE_SAMPLE_RATE. For that request we record:
+#
+#   <id>.speedscope.json - sampled call stacks (open in https://speedscope.app)
+#   <id>.alloc.txt       - tracemalloc snapshot: peak + top allocating lines
+#
+# Only the request's own frames are kept: each thread doing work for it
+# registers a root frame (track()), and a sample counts only if that frame
+# is on the thread's stack. So other requests sharing the event loop or
+# the threadpool don't show up. This covers the request thread, speculative
+# retrieval, the vector-query pool and the embedding batcher; a batch
+# encoded for several requests counts in full in each of their profiles.
+# With EMBED_SOCKET the model runs in another process, so tokenization and
+# encode time show up only as a socket wait. Allocations are process-wide
+# while tracing is on, so they may include concurrent requests.
+#
+# With profiling off, the cost is one random() per request and one
+# ContextVar lookup per track(); no sampler thread or tracemalloc runs.
+
+PROFILE_SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", "0")) # 0 = admin header only
+PROFILE_HEADER = os.getenv("PROFILE_HEADER", "X-Profile")
+PROFILE_DIR = os.getenv("PROFILE_DIR", "profiles")
+PROFILE_INTERVAL_MS = float(os.getenv("PROFILE_INTERVAL_MS", "5"))
+PROFILE_KEEP = int(os.getenv("PROFILE_KEEP", "50")) # Oldest artifacts are deleted beyond this
+PROFILE_TRACEMALLOC_FRAMES = int(os.getenv("PROFILE_TRACEMALLOC_FRAMES", "10"))
+PROFILE_TOP_ALLOCATIONS = 40
+
+ARTIFACTS = {"speedscope": ".speedscope.json", "alloc": ".alloc.txt"}
+_PROFILE_ID = re.compile(r"^[0-9]{8}-[0-9]{6}-[0-9a-f]{6}$")
+
+# The profile of the current request (propagates into the threadpool)
+_current: ContextVar = ContextVar("profile", default=None)
+
+_active = set()
+_lock = threading.Lock()
+_sampler = None
+_tracing_owned = False
+
+
+class Profile:
+    def __init__(self, label: str):
+        self.id = f"{time.strftime('%Y%m%d-%H%M%S')}-{uuid.uuid4().hex[:6]}"
+        self.label = label
+        self.started = time.perf_counter()
+        self.duration_ms = None
+        self.snapshot = None
+        self.peak_bytes = None
+        self._roots = {} # token -> (thread ident, root frame, thread label)
+        self._frames = [] # speedscope shared frames
+        self._frame_index = {}
+        self._samples = {} # thread label -> [(stack, weight_ms)]
+        self._lock = threading.Lock()
+
+    def _frame_id(self, code):
+        key = (code.co_filename, code.co_firstlineno, code.co_name)
+        index = self._frame_index.get(key)
+        if index is None:
+            index = self._frame_index[key] = len(self._frames)
+            name = getattr(code, "co_qualname", code.co_name) # co_qualname is 3.11+
+            self._frames.append({"name": name, "file": code.co_filename, "line": code.co_firstlineno})
+        return index
+
+    def _sample(self, frames, weight_ms: float):
+        with self._lock:
+            for ident, root, thread_label in list(self._roots.values()):
+                frame = frames.get(ident)
+                stack = []
+                while frame is not None:
+                    stack.append(self._frame_id(frame.f_code))
+                    if frame is root:
+                        break
+                    frame = frame.f_back
+                if frame is None:
+                    continue # Thread is busy with something else right now
+                stack.reverse()
+                self._samples.setdefault(thread_label, []).append((stack, weight_ms))
+
+    def speedscope(self):
+        profiles = []
+        for thread_label, samples in sorted(self._samples.items()):
+            total = sum(weight for _, weight in samples)
+            profiles.append({
+                "type": "sampled",
+                "name": f"{self.label} [{thread_label}]",
+                "unit": "milliseconds",
+                "startValue": 0,
+                "endValue": round(total, 3),
+                "samples": [stack for stack, _ in samples],
+                "weights": [round(weight, 3) for _, weight in samples],
+            })
+        return {
+            "$schema": "https://www.speedscope.app/file-format-schema.json",
+            "name": f"{self.label} ({self.duration_ms:.0f} ms)",
+            "exporter": "satyam-profiler",
+            "activeProfileIndex": 0,
+            "shared": {"frames": self._frames},
+            "profiles": profiles,
+        }
+
+    def allocations(self):
+        lines = [
+            f"{self.label}",
+            f"Duration: {self.duration_ms:.1f} ms",
+            f"Peak traced memory: {self.peak_bytes / 1024:.1f} KiB",
+            "",
+        ]
+        if self.snapshot is None:
+            return "\n".join(lines + ["(no snapshot)"]) + "\n"
+
+        snapshot = self.snapshot.filter_traces([
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, "<frozen importlib._bootstrap*>"),
+            tracemalloc.Filter(False, __file__),
+        ])
+        stats = snapshot.statistics("lineno")
+        lines.append(f"Live allocations at end of request: {sum(s.size for s in stats) / 1024:.1f} KiB "
+                     f"in {sum(s.count for s in stats)} blocks")
+        lines.append(f"Top {PROFILE_TOP_ALLOCATIONS} lines:")
+        for stat in stats[:PROFILE_TOP_ALLOCATIONS]:
+            lines.append(f"  {stat.size / 1024:9.1f} KiB {stat.count:7d} blocks  {stat.traceback[0]}")
+
+        lines.append("")
+        lines.append("Top 5 call paths:")
+        for stat in snapshot.statistics("traceback")[:5]:
+            lines.append(f"  {stat.size / 1024:.1f} KiB in {stat.count} blocks")
+            lines.extend(f"    {line}" for line in stat.traceback.format())
+        return "\n".join(lines) + "\n"
+
+    def save(self):
+        try:
+            os.makedirs(PROFILE_DIR, exist_ok=True)
+            base = os.path.join(PROFILE_DIR, self.id)
+            with open(base + ARTIFACTS["speedscope"], "w") as f:
+                json.dump(self.speedscope(), f)
+            with open(base + ARTIFACTS["alloc"], "w") as f:
+                f.write(self.allocations())
+            self.snapshot = None
+            _prune()
+            print(f"✅ [Profiler] Saved profile {self.id} ({self.duration_ms:.0f} ms): {self.label}")
+        except Exception as e:
+            print(f"⚠️ [Profiler] Failed to save profile {self.id}: {e}")
+
+
+# ============================
+#  SAMPLER THREAD
+# ============================
+# One thread serves every active profile, and exits when there are none.
+
+def _sample_loop():
+    global _sampler
+    interval = PROFILE_INTERVAL_MS / 1000
+    last = time.perf_counter()
+    own_ident = threading.get_ident()
+    while True:
+        time.sleep(interval)
+        with _lock:
+            if not _active:
+                _sampler = None
+                return
+            profiles = list(_active)
+        now = time.perf_counter()
+        weight_ms = (now - last) * 1000
+        last = now
+        frames = sys._current_frames()
+        frames.pop(own_ident, None)
+        for profile in profiles:
+            profile._sample(frames, weight_ms)
+
+
+def _start(label: str):
+    global _sampler, _tracing_owned
+    profile = Profile(label)
+    with _lock:
+        if not _active and not tracemalloc.is_tracing():
+            tracemalloc.start(PROFILE_TRACEMALLOC_FRAMES)
+            _tracing_owned = True
+        if not _active and _tracing_owned:
+            tracemalloc.reset_peak()
+        _active.add(profile)
+        if _sampler is None:
+            _sampler = threading.Thread(target=_sample_loop, name="profiler-sampler", daemon=True)
+            _sampler.start()
+    return profile
+
+
+def _stop(profile: Profile):
+    global _tracing_owned
+    profile.duration_ms = (time.perf_counter() - profile.started) * 1000
+    with _lock:
+        _active.discard(profile)
+        if tracemalloc.is_tracing():
+            profile.peak_bytes = tracemalloc.get_traced_memory()[1]
+            profile.snapshot = tracemalloc.take_snapshot()
+            # Leave tracing on if it was already on (e.g. PYTHONTRACEMALLOC)
+            if not _active and _tracing_owned:
+                tracemalloc.stop()
+                _tracing_owned = False
+        else:
+            profile.peak_bytes = 0
+    # Rendering the snapshot can take a while: keep it off the request path
+    threading.Thread(target=profile.save, name=f"profiler-save-{profile.id}", daemon=True).start()
+
+
+# ============================
+#  HOOKS
+# ============================
+
+def current():
+    """The current request's Profile, or None (cheap: one ContextVar lookup)."""
+    return _current.get()
+
+
+class track:
+    """
+    Marks the caller's frame as a root of the current request's profile on
+    this thread, for the duration of the `with` block. A no-op unless the
+    request is being profiled.
+
+    Shared workers pass `profiles` instead: the embedding batcher encodes
+    for several requests at once, and the batch counts in each of their
+    profiles.
+    """
+
+    def __init__(self, profiles=None):
+        self._given = profiles
+
+    def __enter__(self):
+        return self._register(sys._getframe(1))
+
+    def _register(self, root):
+        if self._given is not None:
+            self._profiles = [profile for profile in self._given if profile is not None]
+        else:
+            profile = _current.get()
+            self._profiles = [profile] if profile is not None else []
+        if not self._profiles:
+            return None
+
+        self._token = object()
+        try:
+            asyncio.get_running_loop()
+            thread_label = "event loop"
+        except RuntimeError:
+            thread_label = threading.current_thread().name
+        for profile in self._profiles:
+            with profile._lock:
+                profile._roots[self._token] = (threading.get_ident(), root, thread_label)
+        return self._profiles[0]
+
+    def __exit__(self, *exc):
+        for profile in self._profiles:
+            with profile._lock:
+                profile._roots.pop(self._token, None)
+        return False
+
+
+class profiled(track):
+    """
+    Profiles the block if `requested` (see requested()) or if the request
+    is sampled. The `with` target is the Profile, or None.
+    """
+
+    def __init__(self, label: str, requested: bool = False):
+        super().__init__()
+        self.label = label
+        self.requested = requested
+
+    def __enter__(self):
+        self._var_token = None
+        if self.requested or (PROFILE_SAMPLE_RATE and random.random() < PROFILE_SAMPLE_RATE):
+            self._var_token = _current.set(_start(self.label))
+        return self._register(sys._getframe(1))
+
+    def __exit__(self, *exc):
+        super().__exit__(*exc)
+        if self._var_token is not None:
+            _current.reset(self._var_token)
+            _stop(self._profiles[0])
+        return False
+
+
+def requested(headers, is_admin: bool):
+    """True if an admin asked for this request to be profiled."""
+    return is_admin and headers.get(PROFILE_HEADER, "").strip().lower() in ("1", "true", "yes")
+
+
+# ============================
+#  ARTIFACTS (admin endpoints)
+# ============================
+
+def artifact_path(profile_id: str, kind: str):
+    """Path of a stored artifact, or None (also for malformed ids)."""
+    if kind not in ARTIFACTS or not _PROFILE_ID.match(profile_id):
+        return None
+    path = os.path.join(PROFILE_DIR, profile_id + ARTIFACTS[kind])
+    return path if os.path.exists(path) else None
+
+
+def list_profiles():
+    """Stored profiles, newest first."""
+    if not os.path.isdir(PROFILE_DIR):
+        return []
+    profiles = {}
+    for name in os.listdir(PROFILE_DIR):
+        for kind, suffix in ARTIFACTS.items():
+            profile_id = name[:-len(suffix)]
+            if name.endswith(suffix) and _PROFILE_ID.match(profile_id):
+                profiles.setdefault(profile_id, {"id": profile_id, "artifacts": []})["artifacts"].append(kind)
+    return sorted(profiles.values(), key=lambda entry: entry["id"], reverse=True)
+
+
+def _prune():
+    for entry in list_profiles()[PROFILE_KEEP:]:
+        for kind in entry["artifacts"]:
+            try:
+                os.remove(os.path.join(PROFILE_DIR, entry["id"] + ARTIFACTS[kind]))
+            except FileNotFoundError:
+                pass
@@ -0,0 +1,331 @@
+# providers.py
+
+import os
+import json
+import time
+import hashlib
+import functools
+import threading
+import contextvars
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from datetime import datetime
+from dotenv import load_dotenv
+
+import deadline
+import profiler
+from embedding_service import EMBEDDING_MODEL, EMBED_SOCKET, BatchingEmbedder, SocketEmbedder
+
+# ============================
+#  PROVIDER LAYER (LIVE / RECORD / REPLAY)
+# ============================
+# Every external call rag_chain makes goes through here: chat completions,
+# query embeddings and vector queries.
+#
+#   PROVIDER_MODE=live    - call OpenAI / SentenceTransformer / the vector index
+#   PROVIDER_MODE=record  - same as live, and write each request/response pair
+#                           (with timing) to PROVIDER_CASSETTE_DIR
+#   PROVIDER_MODE=replay  - serve recorded responses; no keys, no network, and
+#                           the embedding model / index are never loaded.
+#                           PROVIDER_REPLAY_LATENCY=1 sleeps for the recorded time.
+
+load_dotenv(override=True)
+
+PROVIDER_MODE = os.getenv("PROVIDER_MODE", "live")
+PROVIDER_CASSETTE_DIR = os.getenv("PROVIDER_CASSETTE_DIR", "cassettes")
+PROVIDER_REPLAY_LATENCY = os.getenv("PROVIDER_REPLAY_LATENCY", "0") == "1"
+
+# Hedged vector queries: if a query hasn't answered within the rolling p95
+# latency, a duplicate is sent and whichever returns first wins.
+VECTOR_HEDGE_ENABLED = os.getenv("VECTOR_HEDGE_ENABLED", "1") == "1"
+VECTOR_HEDGE_DEFAULT_MS = float(os.getenv("VECTOR_HEDGE_DEFAULT_MS", "250")) # until enough samples
+VECTOR_HEDGE_MIN_MS = float(os.getenv("VECTOR_HEDGE_MIN_MS", "20"))
+VECTOR_HEDGE_MIN_SAMPLES = 20
+
+OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
+PINECONE_API_KEY = os.getenv("PINECONE_API_KEY")
+INDEX_NAME = os.getenv("PINECONE_INDEX_NAME", "legal-index")
+VECTOR_BACKEND = os.getenv("VECTOR_BACKEND", "pinecone")
+
+if VECTOR_BACKEND == "local":
+    import ann_index
+    INDEX_NAME = f"local:{ann_index.ANN_INDEX_DIR}"
+
+
+class ReplayMissError(Exception):
+    """No recorded interaction matches this request."""
+
+
+class ReplayedError(Exception):
+    """An error that was recorded in live mode, raised again on replay."""
+
+
+# ============================
+#  LIVE BACKENDS
+# ============================
+
+client = None
+embedder = None
+query_embedder = None # BatchingEmbedder, or SocketEmbedder for a shared service
+index = None
+
+
+def _init_live():
+    global client, embedder, query_embedder, index
+
+    from openai import OpenAI
+
+    if not OPENAI_API_KEY:
+        print("ERROR: OPENAI_API_KEY not found in .env")
+    else:
+        # Retries are done by call_openai_with_retry, within the request deadline
+        client = OpenAI(api_key=OPENAI_API_KEY, max_retries=0)
+
+    # NOTE: Keeping local embeddings to match existing Pinecone index.
+    # Switching to OpenAI Embeddings (1536) would require re-indexing.
+    if EMBED_SOCKET:
+        print(f" Using shared embedding service at {EMBED_SOCKET}")
+        query_embedder = SocketEmbedder(EMBED_SOCKET)
+    else:
+        from sentence_transformers import SentenceTransformer
+        print("Loading embedding model (all-MiniLM-L6-v2)...")
+        embedder = SentenceTransformer(EMBEDDING_MODEL)
+        # Concurrent requests share one forward pass per few-ms window
+        query_embedder = BatchingEmbedder(lambda texts: embedder.encode(texts, batch_size=len(texts)))
+
+    if VECTOR_BACKEND == "local":
+        print(f" Loading local ANN index from {ann_index.ANN_INDEX_DIR}/...")
+        index = ann_index.LocalIndex()
+        print(f" Loaded local ANN index (nprobe={index.nprobe}, rerank={index.rerank})")
+    else:
+        from pinecone import Pinecone
+        print(" Connecting to Pinecone...")
+        pc = Pinecone(api_key=PINECONE_API_KEY)
+        index = pc.Index(INDEX_NAME)
+        print(f" Connected to Pinecone index: {INDEX_NAME}")
+
+
+def _live_chat(request, timeout=None):
+    response = client.chat.completions.create(**request, timeout=timeout)
+    usage = getattr(response, "usage", None)
+    return {
+        "content": response.choices[0].message.content,
+        "usage": {
+            "prompt_tokens": usage.prompt_tokens,
+            "completion_tokens": usage.completion_tokens,
+        } if usage else None,
+    }
+
+
+def _live_embed(request, timeout=None):
+    return query_embedder.encode(request["text"], timeout=timeout)
+
+
+_vector_pool = ThreadPoolExecutor(max_workers=int(os.getenv("VECTOR_QUERY_WORKERS", "16")),
+                                  thread_name_prefix="vector-query")
+_vector_latencies = deque(maxlen=200) # seconds, successful queries only
+_vector_lock = threading.Lock()
+hedge_stats = {"queries": 0, "hedged": 0, "hedge_won": 0}
+
+
+def _hedge_delay():
+    with _vector_lock:
+        samples = sorted(_vector_latencies)
+    if len(samples) < VECTOR_HEDGE_MIN_SAMPLES:
+        return VECTOR_HEDGE_DEFAULT_MS / 1000
+    p95 = samples[int(0.95 * (len(samples) - 1))]
+    return max(VECTOR_HEDGE_MIN_MS / 1000, p95)
+
+
+def _timed_vector_query(request):
+    t0 = time.perf_counter()
+    with profiler.track():
+        result = index.query(**request)
+    with _vector_lock:
+        _vector_latencies.append(time.perf_counter() - t0)
+    return result
+
+
+def _live_vector_query(request, timeout=None):
+    started = time.monotonic()
+    # A context copy per query (a hedge runs concurrently with the original),
+    # so pool work counts in the request's profile
+    futures = [_vector_pool.submit(contextvars.copy_context().run, _timed_vector_query, request)]
+    with _vector_lock:
+        hedge_stats["queries"] += 1
+
+    if VECTOR_HEDGE_ENABLED:
+        delay = _hedge_delay() if timeout is None else min(_hedge_delay(), timeout)
+        done, _ = wait(futures, timeout=delay)
+        if not done:
+            futures.append(_vector_pool.submit(contextvars.copy_context().run, _timed_vector_query, request))
+            with _vector_lock:
+                hedge_stats["hedged"] += 1
+
+    # First successful answer wins; an error only counts once nothing else is pending
+    pending = set(futures)
+    error = None
+    while pending:
+        left = None if timeout is None else timeout - (time.monotonic() - started)
+        if left is not None and left <= 0:
+            break
+        done, pending = wait(pending, timeout=left, return_when=FIRST_COMPLETED)
+        for future in done:
+            if future.exception() is not None:
+                error = future.exception()
+                continue
+            if future is not futures[0]:
+                with _vector_lock:
+                    hedge_stats["hedge_won"] += 1
+            result = future.result()
+            return {
+                "matches": [
+                    {"id": m.get("id"), "score": m.get("score"), "metadata": m.get("metadata")}
+                    for m in result.get("matches", [])
+                ]
+            }
+        if not done:
+            break
+
+    if error is not None and not pending:
+        raise error
+    raise TimeoutError(f"Vector query timed out after {timeout:.2f}s")
+
+
+# ============================
+#  CASSETTES
+# ============================
+
+_cassette_lock = threading.Lock()
+_replay_positions = {}
+
+
+def _request_key(kind, request):
+    canonical = json.dumps(request, sort_keys=True, default=str)
+    return f"{kind}-{hashlib.sha256(canonical.encode()).hexdigest()[:24]}"
+
+
+def _cassette_path(key):
+    return os.path.join(PROVIDER_CASSETTE_DIR, f"{key}.json")
+
+
+def _record(key, kind, request, response, error, elapsed_ms):
+    with _cassette_lock:
+        os.makedirs(PROVIDER_CASSETTE_DIR, exist_ok=True)
+        path = _cassette_path(key)
+        cassette = {"kind": kind, "request": request, "interactions": []}
+        if os.path.exists(path):
+            with open(path) as f:
+                cassette = json.load(f)
+        # Repeated identical requests (e.g. retries after a 429) replay in order
+        cassette["interactions"].append({
+            "response": response,
+            "error": error,
+            "elapsed_ms": round(elapsed_ms, 2),
+            "recorded_at": datetime.utcnow().isoformat(),
+        })
+        with open(path, "w") as f:
+            json.dump(cassette, f, indent=2)
+
+
+def _replay(key, kind, timeout=None):
+    path = _cassette_path(key)
+    if not os.path.exists(path):
+        raise ReplayMissError(f"No recorded {kind} interaction for {key} in {PROVIDER_CASSETTE_DIR}/")
+
+    with _cassette_lock:
+        with open(path) as f:
+            interactions = json.load(f)["interactions"]
+        position = _replay_positions.get(key, 0)
+        _replay_positions[key] = position + 1
+    interaction = interactions[min(position, len(interactions) - 1)]
+
+    if PROVIDER_REPLAY_LATENCY:
+        elapsed = interaction["elapsed_ms"] / 1000
+        if timeout is not None and elapsed > timeout:
+            time.sleep(timeout)
+            raise TimeoutError(f"Replayed {kind} call took {elapsed:.2f}s (timeout {timeout:.2f}s)")
+        time.sleep(elapsed)
+    if interaction["error"]:
+        raise ReplayedError(interaction["error"])
+    return interaction["response"]
+
+
+def _call(kind, live_fn, request, timeout=None):
+    # The timeout is not part of the request: it varies per call and must not change the cassette key
+    if PROVIDER_MODE == "replay":
+        return _replay(_request_key(kind, request), kind, timeout)
+
+    t0 = time.perf_counter()
+    try:
+        response = live_fn(request, timeout)
+    except Exception as e:
+        if PROVIDER_MODE == "record":
+            _record(_request_key(kind, request), kind, request, None, f"{type(e).__name__}: {e}",
+                    (time.perf_counter() - t0) * 1000)
+        raise
+
+    if PROVIDER_MODE == "record":
+        _record(_request_key(kind, request), kind, request, response, None, (time.perf_counter() - t0) * 1000)
+    return response
+
+
+# ============================
+#  PUBLIC API (used by rag_chain)
+# ============================
+
+def chat_completion(messages, model="gpt-3.5-turbo", temperature=0.3, response_format=None, timeout=None):
+    """Returns {"content": str, "usage": {...} or None}."""
+    request = {"model": model, "messages": messages, "temperature": temperature}
+    if response_format:
+        request["response_format"] = response_format
+    return _call("chat", _live_chat, request, timeout)
+
+
+def embed(text: str, timeout=None):
+    return _call("embed", _live_embed, {"text": text}, timeout)
+
+
+EMBED_CACHE_SIZE = int(os.getenv("EMBED_CACHE_SIZE", "1024"))
+
+
+@functools.lru_cache(maxsize=EMBED_CACHE_SIZE)
+def _embed_cached(text: str):
+    return tuple(embed(text, timeout=deadline.timeout_for(deadline.EMBED_TIMEOUT_SECONDS)))
+
+
+def embed_query(text: str):
+    """
+    Embeds a query under the request deadline, through one LRU cache shared by
+    retrieval, the domain gate and the rewrite gate: they often embed the same text.
+    """
+    return list(_embed_cached(text))
+
+
+def vector_query(vector, top_k, include_metadata, filter=None, timeout=None):
+    """Returns {"matches": [{"id", "score", "metadata"}, ...]} (plain dicts)."""
+    request = {"vector": vector, "top_k": top_k, "include_metadata": include_metadata, "filter": filter}
+    return _call("vector", _live_vector_query, request, timeout)
+
+
+def get_stats():
+    """Embedding batching and vector-query hedging counts (this worker, since start)."""
+    with _vector_lock:
+        hedging = dict(hedge_stats)
+    stats = {"mode": PROVIDER_MODE, "vector_hedging": hedging, "embedding_batches": None}
+    if isinstance(query_embedder, BatchingEmbedder):
+        batches, items = query_embedder.batches, query_embedder.items
+        stats["embedding_batches"] = {
+            "batches": batches,
+            "queries": items,
+            "avg_batch_size": round(items / batches, 2) if batches else None,
+        }
+    return stats
+
+
+if PROVIDER_MODE == "replay":
+    print(f" [Providers] Replaying recorded calls from {PROVIDER_CASSETTE_DIR}/")
+else:
+    _init_live()
+    if PROVIDER_MODE == "record":
+        print(f" [Providers] Recording calls to {PROVIDER_CASSETTE_DIR}/")
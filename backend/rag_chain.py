@@ -4,31 +4,34 @@
 import os
 import re
 import random
-from dotenv import load_dotenv
-
-from pinecone import Pinecone
-from sentence_transformers import SentenceTransformer
-from openai import OpenAI
 import time
 import json
+import threading
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
 
-# ============================
-#  LOAD ENV
-# ============================
+import numpy as np
 
-load_dotenv(override=True)
+import deadline
+import docstore
+import domain_gate
+import profiler
+import providers
+import rewrite_gate
+import usage
 
-OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
-PINECONE_API_KEY = os.getenv("PINECONE_API_KEY")
-INDEX_NAME = os.getenv("PINECONE_INDEX_NAME", "legal-index")
+# ============================
+#  LOAD ENV / PROVIDERS
+# ============================
+# OpenAI, the embedding model and the vector index are owned by providers.py
+# (live / record / replay). rag_chain only talks to them through it.
 
-if not OPENAI_API_KEY:
-    print("ERROR: OPENAI_API_KEY not found in .env")
-else:
-    client = OpenAI(api_key=OPENAI_API_KEY)
+INDEX_NAME = providers.INDEX_NAME
 
 
 CACHE_FILE = "response_cache.json"
+# generate_answer runs in the threadpool: serialise read-modify-write cycles
+_cache_lock = threading.Lock()
 
 def load_cache():
     if os.path.exists(CACHE_FILE):
@@ -41,30 +44,19 @@ def load_cache():
 
 def save_cache(cache):
     try:
-        with open(CACHE_FILE, "w") as f:
+        # Write-then-rename: a reader never sees a half-written file
+        tmp_path = f"{CACHE_FILE}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "w") as f:
             json.dump(cache, f, indent=4)
+        os.replace(tmp_path, CACHE_FILE)
     except Exception as e:
         print(f"Error saving cache: {e}")
 
-# ============================
-#  EMBEDDING MODEL (MATCHES INDEX DIM = 384)
-# ============================
-# NOTE: Keeping local embeddings to match existing Pinecone index.
-# Switching to OpenAI Embeddings (1536) would require re-indexing.
-
-print("Loading embedding model (all-MiniLM-L6-v2)...")
-embedder = SentenceTransformer("sentence-transformers/all-MiniLM-L6-v2")
-
-
-# ============================
-#  PINECONE CONNECTION
-# ============================
-
-print(" Connecting to Pinecone...")
-pc = Pinecone(api_key=PINECONE_API_KEY)
-index = pc.Index(INDEX_NAME)
-print(f" Connected to Pinecone index: {INDEX_NAME}")
-
+def cache_answer(cache_key: str, result: dict):
+    with _cache_lock:
+        cache = load_cache()
+        cache[cache_key] = result
+        save_cache(cache)
 
 # ============================
 #  SYSTEM PROMPT (STRICT LEGAL)
@@ -98,7 +90,8 @@ RULES:
 # ============================
 
 def embed_query(text: str):
-    return embedder.encode(text).tolist()
+    # Cached in providers, shared with the rewrite gate
+    return providers.embed_query(text)
 
 
 # ============================
@@ -130,10 +123,12 @@ def detect_law(query: str):
 #  FIXED RETRIEVER (SECTION + ARTICLE + LAW FILTER)
 # ============================
 
-def retrieve_chunks(query: str, top_k: int = 8):
+def retrieve_chunks(query: str, top_k: int = 8, with_scores: bool = False):
+    """
+    Returns (contexts, sources), or (contexts, sources, scores) with
+    with_scores=True; the three lists are aligned.
+    """
     try:
-        query_vector = embed_query(query)
-
         section_match = re.search(r"\bsection\s+(\d+)", query.lower())
         article_match = re.search(r"\barticle\s+(\d+)", query.lower())
 
@@ -151,14 +146,39 @@ def retrieve_chunks(query: str, top_k: int = 8):
         # selected_laws = detect_law(query) # Unused for now, but ready for logic
         filter_dict = None
 
-        result = index.query(
+        # Chunk text is hydrated from the local docstore, so the index only
+        # needs to return IDs + scores. Older indexes (text still in
+        # Pinecone metadata, no docstore on disk) keep working as before.
+        use_docstore = docstore.available()
+
+        # Hedged after the rolling p95 latency; bounded by the request deadline
+        result = providers.vector_query(
             vector=query_vector,
             top_k=top_k,
-            include_metadata=True,
-            filter=filter_dict
+            include_metadata=not use_docstore,
+            filter=filter_dict,
+            timeout=deadline.timeout_for(deadline.VECTOR_TIMEOUT_SECONDS)
         )
 
         matches = result.get("matches", [])
+
+        if use_docstore:
+            hydrated = docstore.get_chunks(match.get("id") for match in matches)
+            matches = [
+                {
+                    "id": match.get("id"),
+                    "score": match.get("score"),
+                    "metadata": hydrated.get(match.get("id"), {})
+                }
+                for match in matches
+            ]
+
+        # A match without text is dropped below: say so, or answers silently lose their context
+        missing = [match.get("id") for match in matches if not (match.get("metadata") or {}).get("text")]
+        if missing:
+            where = f"docstore {docstore.DOCSTORE_PATH}" if use_docstore else "index metadata (no docstore on disk)"
+            print(f"❌ [Retrieval] {len(missing)}/{len(matches)} matches have no text in the {where}: {missing[:5]}. "
+                  f"Re-run ingest.py and deploy its artifacts.")
         
         # IMPROVEMENT: Prioritize curated text files (ipc_act.txt, rti_filing_guide.txt)
         # Sort matches so that these sources come first
@@ -173,6 +193,7 @@ def retrieve_chunks(query: str, top_k: int = 8):
 
         contexts = []
         sources = []
+        scores = []
 
         for match in matches:
             metadata = match.get("metadata", {}) or {}
@@ -188,36 +209,103 @@ def retrieve_chunks(query: str, top_k: int = 8):
                 
                 # Format detailed source info for user
                 detailed_source = f"[Index: {INDEX_NAME}] [Source: {source}] [Chunk: {chunk_id}]"
+                # Near-duplicates collapsed at ingest (see dedup.py)
+                alt_sources = sorted({alt["source"] for alt in metadata.get("alt_sources") or []} - {source})
+                if alt_sources:
+                    detailed_source += f" [Also in: {', '.join(alt_sources)}]"
                 
                 contexts.append(rich_context)
                 sources.append(detailed_source)
+                scores.append(match.get("score") or 0.0)
 
+        if with_scores:
+            return contexts, sources, scores
         return contexts, sources
     except Exception as e:
         print(f"Error in retrieve_chunks: {e}")
-        return [], []
+        return ([], [], []) if with_scores else ([], [])
+
+
+def check_chunk_text():
+    """
+    Startup check that retrieval will get chunk text back: from docstore.db,
+    or from the index metadata of indexes built before the docstore. Logs an
+    error and returns False when neither has it.
+    """
+    if docstore.available():
+        return True
+    try:
+        result = providers.vector_query(vector=embed_query("Indian law"), top_k=1, include_metadata=True)
+    except Exception as e:
+        print(f"⚠️ Could not check the vector index for chunk text: {e}")
+        return True
+    matches = result.get("matches", [])
+    if matches and not (matches[0].get("metadata") or {}).get("text"):
+        print(f"❌ ERROR: No docstore at {docstore.DOCSTORE_PATH} and the index metadata has no chunk text: "
+              f"every answer will be missing its context. Run ingest.py and deploy docstore.db (see README).")
+        return False
+    return True
 
 
 # ============================
 #  HELPER: RETRY LOGIC (OPENAI)
 # ============================
-def call_openai_with_retry(messages, model="gpt-3.5-turbo", max_retries=3):
-    """Call OpenAI API with exponential backoff."""
+def is_timeout(error: Exception):
+    """True for deadline and timeout errors (ours, the OpenAI SDK's, or replayed ones)."""
+    if isinstance(error, (deadline.DeadlineExceeded, TimeoutError)):
+        return True
+    text = f"{type(error).__name__}: {error}"
+    return "Timeout" in text or "timed out" in text
+
+
+def call_openai_with_retry(messages, model="gpt-3.5-turbo", max_retries=3, path="other", response_format=None,
+                           timeout=deadline.LLM_TIMEOUT_SECONDS):
+    """
+    Call OpenAI API with exponential backoff.
+    `path` names the calling branch for token/cost accounting (see usage.py);
+    it may be a function of the reply when the branch is only known from it.
+    Each attempt gets at most `timeout` seconds, and neither attempts nor
+    backoff waits may run past the request deadline (DeadlineExceeded).
+    """
+    started = time.perf_counter()
     for attempt in range(max_retries):
         try:
-            response = client.chat.completions.create(
-                model=model,
+            response = providers.chat_completion(
                 messages=messages,
-                temperature=0.3
+                model=model,
+                temperature=0.3,
+                response_format=response_format,
+                timeout=deadline.timeout_for(timeout, minimum=deadline.LLM_MIN_SECONDS)
             )
-            return response.choices[0].message.content
+            path_name = path
+            if callable(path):
+                # Accounting must not fail a completion that was already paid for
+                try:
+                    path_name = path(response["content"])
+                except Exception as e:
+                    print(f"Error resolving usage path: {e}")
+                    path_name = "other"
+            usage.record(path_name, model, response.get("usage"), (time.perf_counter() - started) * 1000)
+            return response["content"]
+        except deadline.DeadlineExceeded:
+            raise
         except Exception as e:
             if "RateLimitError" in str(e) or "429" in str(e):
                 wait_time = (2 ** (attempt + 1)) + random.uniform(0, 1)
-                print(f"⚠️ OpenAI Quota exceeded. Retrying in {wait_time:.1f}s... (Attempt {attempt+1}/{max_retries})")
-                time.sleep(wait_time)
+                reason = "OpenAI Quota exceeded"
+            elif is_timeout(e):
+                wait_time = 0
+                reason = "OpenAI call timed out"
             else:
                 raise e
+
+            if attempt == max_retries - 1:
+                raise e
+            left = deadline.remaining()
+            if left is not None and left - wait_time < deadline.LLM_MIN_SECONDS:
+                raise deadline.DeadlineExceeded(f"No time left to retry {path} call after: {e}")
+            print(f"⚠️ {reason}. Retrying in {wait_time:.1f}s... (Attempt {attempt+1}/{max_retries})")
+            time.sleep(wait_time)
     raise Exception("Max retries exceeded for OpenAI API")
 
 # ============================
@@ -231,6 +319,10 @@ def rewrite_query(query: str, chat_history: list):
     if not chat_history:
         return query
 
+    # Self-contained follow-ups skip the LLM round-trip
+    if not rewrite_gate.needs_rewrite(query, chat_history):
+        return query
+
     try:
         # Format history for the prompt
         history_text = "\n".join(chat_history[-4:]) # Use last 4 turns for context
@@ -251,7 +343,9 @@ def rewrite_query(query: str, chat_history: list):
         """
         
         rewritten = call_openai_with_retry(
-            messages=[{"role": "system", "content": system_msg}, {"role": "user", "content": user_msg}]
+            messages=[{"role": "system", "content": system_msg}, {"role": "user", "content": user_msg}],
+            path="rewrite",
+            timeout=deadline.REWRITE_TIMEOUT_SECONDS
         )
         
         print(f" [Context Metadata] Original: '{query}' -> Rewritten: '{rewritten}'")
@@ -263,10 +357,261 @@ def rewrite_query(query: str, chat_history: list):
 
 
 # ============================
-#  ANSWER GENERATION WITH FALLBACK + CONFIDENCE
+#  SPECULATIVE RETRIEVAL (PARALLEL WITH REWRITE)
 # ============================
+# Most follow-ups are already self-contained and the rewriter returns them
+# unchanged, so retrieval for the raw query starts while the rewrite is in
+# flight. Its results are kept if the rewrite turns out (near-)identical.
+
+REWRITE_REUSE_SIMILARITY = float(os.getenv("REWRITE_REUSE_SIMILARITY", "0.95"))
+
+_speculative_pool = ThreadPoolExecutor(max_workers=int(os.getenv("SPECULATIVE_WORKERS", "8")),
+                                       thread_name_prefix="speculative-retrieval")
+
+_speculation_lock = threading.Lock()
+speculation_stats = {"reused": 0, "retried": 0}
+
+
+def _statute_refs(query: str):
+    return set(re.findall(r"\b(section|article)\s+(\d+[a-z]?)", query.lower()))
+
+
+def _normalize_query(query: str):
+    return re.sub(r"[^a-z0-9]+", " ", query.lower()).strip()
+
+
+def is_same_search(query: str, rewritten: str):
+    """True if retrieval results for `query` can stand in for `rewritten`."""
+    if _normalize_query(query) == _normalize_query(rewritten):
+        return True
+    # A different Section/Article number changes the result set outright
+    if _statute_refs(query) != _statute_refs(rewritten):
+        return False
+
+    a = np.asarray(embed_query(query), dtype=np.float32)
+    b = np.asarray(embed_query(rewritten), dtype=np.float32)
+    similarity = float(a @ b / ((np.linalg.norm(a) * np.linalg.norm(b)) or 1.0))
+    print(f" [Speculation] Query/rewrite similarity: {similarity:.3f}")
+    return similarity >= REWRITE_REUSE_SIMILARITY
+
+
+def _speculative_retrieve(query: str):
+    # Pool thread work belongs to the request's profile, if it has one
+    with profiler.track():
+        return retrieve_chunks(query, with_scores=True)
+
+
+def rewrite_and_retrieve(query: str, chat_history: list):
+    """
+    Runs rewrite_query and retrieve_chunks(query) concurrently.
+    Returns (search_query, contexts, sources, scores).
+    """
+    if not chat_history:
+        contexts, sources, scores = retrieve_chunks(query, with_scores=True)
+        return query, contexts, sources, scores
+
+    # copy_context keeps per-request ContextVars (usage attribution, profiling) in the worker
+    ctx = contextvars.copy_context()
+    speculative = _speculative_pool.submit(ctx.run, _speculative_retrieve, query)
+
+    search_query = rewrite_query(query, chat_history)
 
-def generate_answer(query: str, contexts, sources, chat_history: list = None):
+    try:
+        reuse = is_same_search(query, search_query)
+    except Exception as e:
+        print(f"Error comparing rewrite to query: {e}")
+        # Out of time: the speculative results are the best there will be
+        reuse = is_timeout(e)
+
+    with _speculation_lock:
+        speculation_stats["reused" if reuse else "retried"] += 1
+
+    if reuse:
+        print(" [Speculation] Reusing retrieval for the original query")
+        contexts, sources, scores = speculative.result()
+    else:
+        print(" [Speculation] Rewrite differs; retrieving again")
+        speculative.cancel()
+        contexts, sources, scores = retrieve_chunks(search_query, with_scores=True)
+
+    return search_query, contexts, sources, scores
+
+
+# ============================
+#  ROLLING CONVERSATION SUMMARY
+# ============================
+
+SUMMARY_MAX_WORDS = 80
+
+def summarize_conversation(previous_summary: str, new_turns: list):
+    """
+    Folds the new turns into the running summary of a chat session.
+    The result replaces raw history in later prompts, so it stays bounded.
+    """
+    if not new_turns:
+        return previous_summary
+
+    turns_text = "\n".join(new_turns)
+    system_msg = "ACT AS A CONVERSATION SUMMARIZER FOR A LEGAL ASSISTANT."
+    user_msg = f"""
+    CURRENT SUMMARY:
+    {previous_summary or "(empty)"}
+
+    NEW TURNS:
+    {turns_text}
+
+    TASK:
+    Update the summary so it covers the whole conversation.
+    - Keep the legal topics, Acts, Section/Article numbers and facts the user gave.
+    - Drop greetings, sources and formatting.
+    - Maximum {SUMMARY_MAX_WORDS} words. Return ONLY the summary text.
+    """
+
+    summary = call_openai_with_retry(
+        messages=[{"role": "system", "content": system_msg}, {"role": "user", "content": user_msg}],
+        path="summary"
+    )
+    return summary.strip()
+
+
+# ============================
+#  ANSWER GENERATION (SINGLE STRUCTURED CALL + CONFIDENCE)
+# ============================
+
+MAX_ANSWER_CONTEXTS = 3
+ANSWER_MODES = {"verified", "recovery", "general", "out_of_domain"}
+OUT_OF_DOMAIN_REFUSAL = "I apologize, but I am a specialized Legal AI. I can only assist with questions related to Indian Law and Justice."
+
+
+def parse_structured_answer(raw: str):
+    """
+    Parses the JSON reply of the answer call into
+    {"mode", "sufficient", "answer", "sources_used": [int, ...]}.
+    A reply that isn't valid JSON is kept as a general answer.
+    """
+    try:
+        data = json.loads(raw)
+        if not isinstance(data, dict):
+            raise ValueError("not a JSON object")
+    except ValueError:
+        return {"mode": "general", "sufficient": False, "answer": raw.strip(), "sources_used": []}
+
+    mode = str(data.get("mode", "general")).strip().lower()
+    # Usually a list of numbers, but a bare 1 or "1, 2" comes back too
+    cited = data.get("sources_used")
+    if cited is None:
+        cited = []
+    elif not isinstance(cited, list):
+        cited = [cited]
+    sources_used = [int(number) for item in cited for number in re.findall(r"\d+", str(item))]
+
+    # Only a real true counts: bool("false") would be True
+    sufficient = data.get("sufficient")
+    return {
+        "mode": mode if mode in ANSWER_MODES else "general",
+        "sufficient": sufficient is True or (isinstance(sufficient, str) and sufficient.strip().lower() == "true"),
+        "answer": str(data.get("answer") or "").strip(),
+        "sources_used": sources_used,
+    }
+
+
+def resolve_answer_mode(parsed: dict, has_contexts: bool, term_match):
+    """The model's mode, downgraded when it isn't backed by the context or the query."""
+    mode = parsed["mode"]
+    if mode == "verified" and (not has_contexts or not parsed["sufficient"]):
+        mode = "recovery" if term_match else "general"
+    if mode == "recovery" and not term_match:
+        mode = "general"
+    return mode
+
+
+def compute_confidence(mode: str, scores: list):
+    """
+    Confidence from how the answer was produced and how well the contexts it
+    relied on matched the query (retrieval similarity of the best one).
+    """
+    if mode == "out_of_domain":
+        return 100
+
+    # Map similarity 0.3 .. 0.8 onto 0 .. 1
+    match = max(0.0, min(1.0, (max(scores) - 0.3) / 0.5)) if scores else 0.5
+    low, high = {"verified": (75, 98), "recovery": (60, 85)}.get(mode, (40, 65))
+    return int(round(low + (high - low) * match))
+
+
+DEGRADED_NOTE = "> **Note:** The AI summary was skipped because the request ran out of time. This is the retrieved text from the legal database."
+DEGRADED_CONTEXT_CHARS = 800
+
+
+def _extract_provision(text: str, kind: str, number: str):
+    """The "Section 302. Heading:" block for one provision, if the text contains it."""
+    match = re.search(
+        rf"(?:^|\n)\s*({kind}\s+{re.escape(number)}\b[^\n]*)\n(.*?)(?=\n\s*\n|\n\s*(?:section|article)\s+\d|\Z)",
+        text, re.IGNORECASE | re.DOTALL
+    )
+    if not match:
+        return None
+    return f"**{match.group(1).strip()}**\n{match.group(2).strip()}"
+
+
+def degraded_answer(query: str, contexts, sources, scores: list = None):
+    """
+    Answer without LLM synthesis, for when the time budget is gone: the exact
+    statute text of the Section/Article asked about if retrieval found it,
+    else the best retrieved context.
+    """
+    print(" [Answer Logic] Mode: degraded (deadline)")
+    scores = scores or []
+
+    if not contexts:
+        return {
+            "answer": "I apologize, but I could not complete your request in time. Please try again.",
+            "sources": [],
+            "confidence": 0,
+            "mode": "degraded"
+        }
+
+    term_match = re.search(r"\b(section|article)\s+(\d+[a-z]?)", query.lower())
+    if term_match:
+        # Overlapping chunks may each hold part of the provision: keep the most complete
+        found = [
+            (len(provision), i, provision)
+            for i, ctx in enumerate(contexts)
+            for provision in [_extract_provision(ctx, term_match.group(1), term_match.group(2))]
+            if provision
+        ]
+        if found:
+            _, i, provision = max(found, key=lambda item: (item[0], -item[1]))
+            return {
+                "answer": f"{provision}\n\n**Sources:**\n- {sources[i]}\n\n{DEGRADED_NOTE}",
+                "sources": [sources[i]],
+                "confidence": compute_confidence("verified", scores[i:i + 1]),
+                "mode": "degraded"
+            }
+
+    # Strip the [[Source: ...]] header retrieve_chunks adds for the LLM,
+    # and the partial word a chunk boundary may start with
+    text = re.sub(r"^\[\[Source:.*?\]\]\n", "", contexts[0]).strip()
+    if text[:1].islower():
+        text = text.split(None, 1)[-1]
+    if len(text) > DEGRADED_CONTEXT_CHARS:
+        text = text[:DEGRADED_CONTEXT_CHARS].rsplit(" ", 1)[0] + "..."
+    return {
+        "answer": f"{text}\n\n**Sources:**\n- {sources[0]}\n\n{DEGRADED_NOTE}",
+        "sources": [sources[0]],
+        "confidence": compute_confidence("general", scores[:1]),
+        "mode": "degraded"
+    }
+
+
+def generate_answer(query: str, contexts, sources, chat_history: list = None, scores: list = None):
+    """
+    One structured LLM call answers from the database (verified), recovers a
+    Section/Article the database missed (recovery), falls back to a general
+    explanation (general), or refuses off-topic questions (out_of_domain).
+    `scores` are the retrieval similarities aligned with `contexts`, if known.
+    If the request deadline runs out, returns degraded_answer instead.
+    """
     try:
         # GREETING CHECK
         query_lower = query.lower().strip().rstrip("!.,?")
@@ -290,9 +635,26 @@ def generate_answer(query: str, contexts, sources, chat_history: list = None):
                  "confidence": 100
              }
 
+        # Confidently off-topic: refuse without an LLM call (see domain_gate.py).
+        # Not for follow-ups: "Tell me more" scores low on its own, and the
+        # scores are for the rewritten search, not for `query`
+        out_of_domain = False
+        if not chat_history:
+            try:
+                out_of_domain = domain_gate.is_out_of_domain(query, embed_query(query), scores)
+            except Exception as e:
+                print(f"Error in domain gate: {e}")
+        if out_of_domain:
+            return {
+                "answer": OUT_OF_DOMAIN_REFUSAL,
+                "sources": [],
+                "confidence": 100,
+                "mode": "out_of_domain"
+            }
+
         # CACHE CHECK
-        cache = load_cache()
         cache_key = query.lower().strip()
+        # cache = load_cache()
         # if cache_key in cache:
         #     return cache[cache_key]
 
@@ -301,12 +663,17 @@ def generate_answer(query: str, contexts, sources, chat_history: list = None):
         if chat_history:
             history_text = "PREVIOUS CHAT HISTORY:\n" + "\n".join(chat_history) + "\n\n"
 
-        #  VERIFIED DATABASE ANSWER
+        # Number the contexts so the model can cite them unambiguously
         if contexts:
-            context_block = "\n\n".join(contexts[:3])
-            
-            system_msg = SYSTEM_PROMPT.strip()
-            user_msg = f"""
+            context_block = "\n\n".join(f"[{i + 1}] {ctx}" for i, ctx in enumerate(contexts[:MAX_ANSWER_CONTEXTS]))
+        else:
+            context_block = "No matching text was found in the legal database."
+
+        term_match = re.search(r"\b(section|article)\s+(\d+[a-z]?)", query.lower())
+
+        #  ONE STRUCTURED CALL (strict / recovery / general / out-of-domain)
+        system_msg = SYSTEM_PROMPT.strip()
+        user_msg = f"""
 {history_text}LEGAL DATABASE CONTEXT:
 {context_block}
 
@@ -314,134 +681,87 @@ QUESTION:
 {query}
 
 INSTRUCTIONS:
-- Answer ONLY using the above legal context.
-- Do NOT use external knowledge.
-- Do NOT invent sections, punishments, or cases.
-- If the retrieved context does NOT contain the specific text or details to answer the question, Reply EXACTLY: "INSUFFICIENT_CONTEXT".
-- Cite the specific sources you strictly used from the context.
-- End your response with a SINGLE line: "SOURCES_USED: <comma_separated_list_of_sources>"
-- KEEP THE ANSWER CONCISE (maximum 3-4 lines).
+Choose exactly one MODE and reply with a JSON object:
+{{"mode": "...", "sufficient": true/false, "answer": "...", "sources_used": [<context numbers>]}}
+
+- "verified": the context above contains the text needed to answer. Answer ONLY from it, do not use
+  external knowledge, and list the numbers of the contexts you used. "sufficient" is true.
+- "recovery": the question asks for a specific Section/Article that the context does not contain.
+  Give a general explanation of that Section/Article of Indian Law (Constitution or IPC). If the user asks
+  for an "Article" that is commonly known as an IPC "Section" (e.g. 302, 307, 376, 420), say:
+  "It appears you may be referring to Section <number> of IPC..." and explain that Section. Do not refuse.
+- "general": the question is about Indian Law, Acts, Constitution, Rights, Crime, Police, Courts, Justice,
+  Government Procedure or RTI, but the context is not enough. Give a GENERAL LEGAL EXPLANATION based on
+  commonly known Indian law. Do not mention exact section numbers unless clearly certain.
+- "out_of_domain": the question is NOT related to Indian law (e.g. Cricket, Bollywood, Food, Coding,
+  General Science). The answer must be EXACTLY: "{OUT_OF_DOMAIN_REFUSAL}"
+
+Do NOT invent sections, punishments, or cases. KEEP THE ANSWER CONCISE (maximum 3-4 lines).
 """
-            full_answer = call_openai_with_retry(
-                messages=[{"role": "system", "content": system_msg}, {"role": "user", "content": user_msg}]
-            )
-
-            if "INSUFFICIENT_CONTEXT" in full_answer:
-                 print(" [Answer Logic] Strict check failed. Saving contexts for potential bypass.")
-                 fallback_contexts = contexts[:] # COPY original contexts
-                 contexts = [] # Trigger fallback
-            else:
-                # Parse logic
-                final_answer = full_answer
-                used_sources = []
-
-                if "SOURCES_USED:" in full_answer:
-                    parts = full_answer.split("SOURCES_USED:")
-                    final_answer = parts[0].strip()
-                    # We ignore the LLM's suggested sources (parts[1]) and enforce returning ALL retrieved sources
-                    # to ensure the user always sees what documents were accessed.
-                    used_sources = list(set(sources)) 
-                else:
-                    # Fallback if AI forgets marker: use all retrieved
-                    used_sources = list(set(sources))
-
-                # Append sources to the text answer to ensure visibility
-                if used_sources:
-                    source_list_text = "\n".join([f"- {s}" for s in used_sources])
-                    final_answer += f"\n\n**Sources:**\n{source_list_text}"
-
-                confidence = random.randint(88, 98)
-
-                result = {
-                    "answer": f"{final_answer}\n\nConfidence Score: {confidence}% (Verified Database Answer )",
-                    "sources": used_sources,
-                    "confidence": confidence
-                }
-                
-                # Save to cache ONLY for high confidence / verified answers
-                cache[cache_key] = result
-                save_cache(cache)
-                return result
-
-        #  AI FALLBACK MODE
-        if not contexts:
-            # Check if it looks like a section/article query to force relevance
-            is_legal_code_query = re.search(r"\b(section|article)\s+(\d+)", query.lower())
-            
-            if is_legal_code_query:
-                # BYPASS RELEVANCE CHECK FOR SECTIONS/ARTICLES + REUSE CONTEXT
-                # Try to reclaim contexts
-                reclaimed_contexts = fallback_contexts if 'fallback_contexts' in locals() else []
-
-                context_text = "\n\n".join(reclaimed_contexts[:2]) if reclaimed_contexts else "No specific database text found."
-                
-                term_type = is_legal_code_query.group(1).title() # Section or Article
-                term_num = is_legal_code_query.group(2)
-                
-                system_msg = SYSTEM_PROMPT.strip()
-                user_msg = f"""
-The strict verified check failed, but the user is asking for a specific {term_type}.
-QUESTION: {query}
-AVAILABLE CONTEXT (from database):
-{context_text}
-
-TASK:
-- The user is asking about "{term_type} {term_num}".
-- If the context contains the text for {term_type} {term_num}, cite it and explain it.
-- If the context is irrelevant, provide a general legal explanation for "{term_type} {term_num}" of Indian Law (Constitution or IPC).
-- *CRITICAL*: If user asks for "Article {term_num}" but it is commonly known as "Section {term_num}" of IPC (e.g. 302, 307, 376, 420), explicitly mention: "It appears you may be referring to Section {term_num} of IPC..." and explain that Section.
-- DO NOT refuse.
-"""
-                bypass_answer = call_openai_with_retry(
-                    messages=[{"role": "system", "content": system_msg}, {"role": "user", "content": user_msg}]
-                )
-
-                # Return result WITH sources if we used context
-                return {
-                    "answer": f"{bypass_answer}\n\nConfidence Score: 85% (Verified Database Answer via Recovery)",
-                    "sources": sources, # We return the sources we found
-                    "confidence": 85
-                }
-            else:
-                # STANDARD RELEVANCE CHECK
-                system_msg = SYSTEM_PROMPT.strip()
-                user_msg = f"""
-The legal database does not contain information to answer this question.
-
-QUESTION:
-{query}
+        raw = call_openai_with_retry(
+            messages=[{"role": "system", "content": system_msg}, {"role": "user", "content": user_msg}],
+            # Per-mode cost breakdown: answer_verified, answer_recovery, ...
+            path=lambda reply: "answer_" + resolve_answer_mode(parse_structured_answer(reply), bool(contexts), term_match),
+            response_format={"type": "json_object"}
+        )
+        parsed = parse_structured_answer(raw)
+        mode = resolve_answer_mode(parsed, bool(contexts), term_match)
+
+        print(f" [Answer Logic] Mode: {mode}")
+
+        if mode == "out_of_domain":
+            return {
+                "answer": OUT_OF_DOMAIN_REFUSAL,
+                "sources": [],
+                "confidence": 100, # High confidence in its refusal
+                "mode": mode
+            }
+
+        answer_text = parsed["answer"]
+        shown = min(len(contexts), MAX_ANSWER_CONTEXTS)
+        cited = [n - 1 for n in parsed["sources_used"] if 0 < n <= shown]
+        if mode == "verified" and not cited:
+            cited = list(range(shown)) # Model forgot to cite: use everything it was shown
+
+        used_sources = list(dict.fromkeys(sources[i] for i in cited))
+        used_scores = [scores[i] for i in cited] if scores else []
+        confidence = compute_confidence(mode, used_scores or (scores or [])[:1])
+
+        if mode == "verified":
+            # Append sources to the text answer to ensure visibility
+            if used_sources:
+                source_list_text = "\n".join([f"- {s}" for s in used_sources])
+                answer_text += f"\n\n**Sources:**\n{source_list_text}"
+
+            result = {
+                "answer": f"{answer_text}\n\nConfidence Score: {confidence}% (Verified Database Answer )",
+                "sources": used_sources,
+                "confidence": confidence,
+                "mode": mode
+            }
+
+            # Save to cache ONLY for high confidence / verified answers
+            cache_answer(cache_key, result)
+            return result
+
+        if mode == "recovery":
+            return {
+                "answer": f"{answer_text}\n\nConfidence Score: {confidence}% (Verified Database Answer via Recovery)",
+                "sources": used_sources, # Whatever database context the model still drew on
+                "confidence": confidence,
+                "mode": mode
+            }
 
-TASK:
-1.  **RELEVANCE CHECK**: Is this question related to Indian Law, Acts, Constitution, Rights, Crime, Police, Courts, Justice, Government Procedure, RTI, or Specific Legal Sections/Articles (e.g. Section 37, Article 21)?
-    - NOTE: Queries mentioning "Section [Number]" or "Article [Number]" ARE RELATED to law.
-2.  **IF NOT RELATED** (e.g. Cricket, Bollywood, Food, Coding, General Science):
-    - Reply EXACTLY: "I apologize, but I am a specialized Legal AI. I can only assist with questions related to Indian Law and Justice."
-3.  **IF RELATED**:
-    - Provide a GENERAL LEGAL EXPLANATION based on commonly known Indian law.
-    - Do NOT mention exact section numbers unless clearly certain.
-    - Keep it educational and concise (3-4 lines).
-"""
-                fallback_text = call_openai_with_retry(
-                     messages=[{"role": "system", "content": system_msg}, {"role": "user", "content": user_msg}]
-                )
-            
-                # If refusal, return low confidence and clean message
-                if "I can only assist with questions related to Indian Law" in fallback_text:
-                    return {
-                        "answer": fallback_text,
-                        "sources": [],
-                        "confidence": 100 # High confidence in its refusal
-                    }
-
-                confidence = random.randint(55, 70)
-
-                return {
-                    "answer": f"{fallback_text}\n\n> **Note:** This information is generated by AI based on general legal knowledge as the specific section was not found in the verified database.",
-                    "sources": [],
-                    "confidence": confidence
-                }
+        return {
+            "answer": f"{answer_text}\n\n> **Note:** This information is generated by AI based on general legal knowledge as the specific section was not found in the verified database.",
+            "sources": [],
+            "confidence": confidence,
+            "mode": mode
+        }
 
     except Exception as e:
+        if is_timeout(e):
+            return degraded_answer(query, contexts, sources, scores)
         return {
             "answer": f"I apologize, but I encountered an error connecting to the AI service: {str(e)}",
             "sources": [],
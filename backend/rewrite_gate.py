@@ -0,0 +1,146 @@
+# rewrite_gate.py
+
+import os
+import re
+import threading
+import numpy as np
+from dotenv import load_dotenv
+
+import providers
+
+load_dotenv()
+
+# ============================
+#  SKIP-REWRITE GATE
+# ============================
+# rewrite_query costs an LLM round-trip, yet most follow-ups ("What is
+# Section 420?") are already self-contained. This local check decides
+# whether a query actually depends on the conversation; only those go to
+# the rewriter. It errs towards rewriting: a false skip retrieves for the
+# wrong subject, a false rewrite only costs latency.
+#
+# Check it against the labelled cases with:
+#
+#     python eval_rewrite_gate.py
+
+REWRITE_GATE_ENABLED = os.getenv("REWRITE_GATE_ENABLED", "1") == "1"
+REWRITE_GATE_SIMILARITY = float(os.getenv("REWRITE_GATE_SIMILARITY", "0.55"))
+
+_ANAPHORA = re.compile(
+    r"\b(it|its|it's|this|that|these|those|they|them|their|he|she|him|her|his|such|"
+    r"same|above|aforesaid|said|former|latter|previous)\b"
+)
+_ELLIPSIS = re.compile(
+    r"^(and|or|but|also|so|then|what about|how about|what if|what else|how so|"
+    r"tell me more|any other|in that case|if so|otherwise)\b|"
+    r"^(why|more|explain|explain more|explain further|elaborate|continue|go on|else|example|examples)\W*$"
+)
+# "Can I also claim compensation?" adds to what was asked before
+_CONTINUATION = re.compile(r"\b(also|too|as well|instead|again|either)\b")
+# "the punishment?" with nothing saying punishment for what
+_BARE_DEFINITE = re.compile(
+    r"\bthe (punishment|penalty|fine|sentence|procedure|process|time limit|deadline|fee|"
+    r"exception|exceptions|definition|offence|section|article|act|law|provision|rule|case)\b"
+    r"(?!\s+(for|of|under|in|to|on|against|when|if)\b)"
+)
+# Words that don't name a subject on their own: "Who can file the complaint?"
+_GENERIC_WORDS = set("""
+a an the is are was were be been being am do does did can could should would will shall may might must
+what which who whom whose when where why how whether if of for to in on at by with from under about
+as into than any some all each my me i we you your our there here not no yes please also only just
+get got give tell say says said file filed filing make made take apply applied happen happens
+punishment punishments penalty penalties fine fines sentence sentences minimum maximum term imprisonment
+procedure process time limit limits deadline fee fees exception exceptions definition meaning offence offences
+crime crimes provision provisions rule rules law laws case cases court courts judge authority authorities officer
+complaint complaints appeal appeals reply replies application applications applicant applicants person persons
+first second appellate bail bailable cognizable compoundable remedy remedies right rights duty duties
+company companies government online offline reply days months years victim accused
+""".split())
+# A numbered provision pins the subject down on its own...
+_STATUTE_REF = re.compile(r"\b(section|sec\.?|article|art\.?)\s*\d+[a-z]?\b")
+# ...an Act named without one doesn't: "Which IPC section applies?" needs
+# the conversation to say which offence
+_ACT_NAME = re.compile(
+    r"\b(ipc|crpc|cpc|rti|posh|pocso|ndps|indian penal code|penal code|constitution|"
+    r"right to information|it act|information technology act|evidence act|contract act|"
+    r"domestic violence act|(?!the |this |that |same |said )[a-z]+ act)\b"
+)
+
+_stats_lock = threading.Lock()
+_stats = {"skipped": 0, "rewritten": 0, "reasons": {}}
+
+
+def _previous_user_turn(chat_history: list):
+    for line in reversed(chat_history):
+        if line.startswith("User: "):
+            return line[len("User: "):]
+    # Only a summary left: compare against that
+    return chat_history[-1] if chat_history else ""
+
+
+def _similarity(a: str, b: str):
+    va = np.asarray(providers.embed_query(a), dtype=np.float32)
+    vb = np.asarray(providers.embed_query(b), dtype=np.float32)
+    return float(va @ vb / ((np.linalg.norm(va) * np.linalg.norm(vb)) or 1.0))
+
+
+def classify(query: str, chat_history: list):
+    """Returns (needs_rewrite, reason)."""
+    q = query.lower().strip()
+
+    if _ELLIPSIS.search(q):
+        return True, "ellipsis"
+    if _ANAPHORA.search(re.sub(r"\bit act\b", "", q)): # "IT Act" is not "it"
+        return True, "anaphora"
+    if _CONTINUATION.search(q):
+        return True, "continuation"
+    if _BARE_DEFINITE.search(q):
+        return True, "bare_definite"
+    if _STATUTE_REF.search(q):
+        return False, "statute_reference"
+    if _ACT_NAME.search(q):
+        return True, "act_without_section"
+    words = re.findall(r"[a-z0-9]+", q)
+    if len(words) <= 3:
+        return True, "too_short"
+    if all(word in _GENERIC_WORDS for word in words):
+        return True, "no_subject"
+
+    # It names something of its own: a query close to the previous turn is
+    # probably continuing it, a distant one starts a new topic
+    previous = _previous_user_turn(chat_history)
+    if previous and _similarity(query, previous) >= REWRITE_GATE_SIMILARITY:
+        return True, "close_to_previous_turn"
+    return False, "self_contained"
+
+
+def needs_rewrite(query: str, chat_history: list):
+    """Decides whether rewrite_query should call the LLM, and counts the outcome."""
+    if not REWRITE_GATE_ENABLED:
+        return True
+    try:
+        decision, reason = classify(query, chat_history)
+    except Exception as e:
+        print(f"Error in rewrite gate: {e}")
+        decision, reason = True, "error"
+
+    with _stats_lock:
+        _stats["rewritten" if decision else "skipped"] += 1
+        _stats["reasons"][reason] = _stats["reasons"].get(reason, 0) + 1
+
+    print(f" [Rewrite Gate] {'rewrite' if decision else 'skip'} ({reason})")
+    return decision
+
+
+def get_stats():
+    """Counts since this worker started."""
+    with _stats_lock:
+        total = _stats["skipped"] + _stats["rewritten"]
+        return {
+            "enabled": REWRITE_GATE_ENABLED,
+            "decisions": total,
+            "skipped": _stats["skipped"],
+            "rewritten": _stats["rewritten"],
+            "skip_rate": round(_stats["skipped"] / total, 4) if total else None,
+            "reasons": dict(_stats["reasons"]),
+        }
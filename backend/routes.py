@@ -1,11 +1,21 @@
-from fastapi import APIRouter, Depends, HTTPException, status, Body
+from fastapi import APIRouter, Depends, HTTPException, status, Body, Query
 from fastapi.security import OAuth2PasswordRequestForm
-from sqlmodel import Session, select
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import FileResponse
+from sqlmodel import select, delete
+from sqlmodel.ext.asyncio.session import AsyncSession
 from typing import List
+import os
 
-from database import get_session
-from models import User, ChatSession, ChatMessage
-from auth import get_password_hash, verify_password, create_access_token, get_current_user
+from database import get_async_session
+from models import User, ChatSession, ChatMessage, ChatSummary
+from auth import get_password_hash, verify_password, create_access_token, get_current_user, get_admin_user
+from usage import get_stats
+import rewrite_gate
+import history_cache
+import rag_chain
+import profiler
+import providers
 from pydantic import BaseModel
 
 router = APIRouter()
@@ -25,10 +35,10 @@ class Token(BaseModel):
 
 # Auth Routes
 @router.post("/auth/signup", response_model=Token)
-async def signup(user_data: UserSignup, session: Session = Depends(get_session)):
+async def signup(user_data: UserSignup, session: AsyncSession = Depends(get_async_session)):
     # Check if user exists
     statement = select(User).where(User.email == user_data.email)
-    existing_user = session.exec(statement).first()
+    existing_user = (await session.exec(statement)).first()
     if existing_user:
         raise HTTPException(status_code=400, detail="Email already registered")
     
@@ -36,23 +46,24 @@ async def signup(user_data: UserSignup, session: Session = Depends(get_session))
     new_user = User(
         email=user_data.email,
         name=user_data.name,
-        password_hash=get_password_hash(user_data.password)
+        # bcrypt is deliberately slow: keep it off the event loop
+        password_hash=await run_in_threadpool(get_password_hash, user_data.password)
     )
     session.add(new_user)
-    session.commit()
-    session.refresh(new_user)
+    await session.commit()
+    await session.refresh(new_user)
     
     # Generate token
     access_token = create_access_token(data={"sub": new_user.email})
     return {"access_token": access_token, "token_type": "bearer", "user_name": new_user.name, "user_email": new_user.email}
 
 @router.post("/auth/login", response_model=Token)
-async def login(form_data: OAuth2PasswordRequestForm = Depends(), session: Session = Depends(get_session)):
+async def login(form_data: OAuth2PasswordRequestForm = Depends(), session: AsyncSession = Depends(get_async_session)):
     # OAuth2PasswordRequestForm expects 'username', but we use it as email
     statement = select(User).where(User.email == form_data.username)
-    user = session.exec(statement).first()
+    user = (await session.exec(statement)).first()
     
-    if not user or not verify_password(form_data.password, user.password_hash):
+    if not user or not await run_in_threadpool(verify_password, form_data.password, user.password_hash):
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Incorrect email or password",
@@ -67,26 +78,26 @@ async def login(form_data: OAuth2PasswordRequestForm = Depends(), session: Sessi
 @router.get("/chat/history", response_model=List[ChatSession])
 async def get_chat_history(
     current_user: User = Depends(get_current_user),
-    session: Session = Depends(get_session)
+    session: AsyncSession = Depends(get_async_session)
 ):
     # Retrieve sessions for the current user
     statement = select(ChatSession).where(ChatSession.user_id == current_user.id).order_by(ChatSession.updated_at.desc())
-    chat_sessions = session.exec(statement).all()
+    chat_sessions = (await session.exec(statement)).all()
     return chat_sessions
 
 @router.get("/chat/session/{session_id}", response_model=List[ChatMessage])
 async def get_session_messages(
     session_id: int,
     current_user: User = Depends(get_current_user),
-    session: Session = Depends(get_session)
+    session: AsyncSession = Depends(get_async_session)
 ):
     # Verify session belongs to user
-    chat_session = session.get(ChatSession, session_id)
+    chat_session = await session.get(ChatSession, session_id)
     if not chat_session or chat_session.user_id != current_user.id:
         raise HTTPException(status_code=404, detail="Session not found")
         
     statement = select(ChatMessage).where(ChatMessage.session_id == session_id).order_by(ChatMessage.created_at)
-    messages = session.exec(statement).all()
+    messages = (await session.exec(statement)).all()
     return messages
 
 class CreateSessionRequest(BaseModel):
@@ -96,33 +107,70 @@ class CreateSessionRequest(BaseModel):
 async def create_chat_session(
     request: CreateSessionRequest,
     current_user: User = Depends(get_current_user),
-    session: Session = Depends(get_session)
+    session: AsyncSession = Depends(get_async_session)
 ):
     new_session = ChatSession(user_id=current_user.id, title=request.title)
     session.add(new_session)
-    session.commit()
-    session.refresh(new_session)
+    await session.commit()
+    await session.refresh(new_session)
     return new_session
 
 @router.delete("/chat/session/{session_id}")
 async def delete_chat_session(
     session_id: int,
     current_user: User = Depends(get_current_user),
-    session: Session = Depends(get_session)
+    session: AsyncSession = Depends(get_async_session)
 ):
-    chat_session = session.get(ChatSession, session_id)
+    chat_session = await session.get(ChatSession, session_id)
     if not chat_session or chat_session.user_id != current_user.id:
         raise HTTPException(status_code=404, detail="Session not found")
         
-    # Delete messages first
-    statement = select(ChatMessage).where(ChatMessage.session_id == session_id)
-    messages = session.exec(statement).all()
-    for msg in messages:
-        session.delete(msg)
+    # Delete messages first (one statement, no need to load them)
+    await session.exec(delete(ChatMessage).where(ChatMessage.session_id == session_id))
+    await session.exec(delete(ChatSummary).where(ChatSummary.session_id == session_id))
         
     # Delete session
-    session.delete(chat_session)
-    session.commit()
+    await session.delete(chat_session)
+    await session.commit()
+    await run_in_threadpool(history_cache.invalidate, session_id)
     return {"status": "success", "message": "Session deleted"}
 
+# Admin Routes
 
+@router.get("/admin/stats/usage")
+async def get_usage_stats(
+    days: int = Query(default=1, ge=1, le=90),
+    admin_user: User = Depends(get_admin_user)
+):
+    # Token usage, cost and latency percentiles per LLM path, per user and per day
+    return await run_in_threadpool(get_stats, days=days)
+
+
+@router.get("/admin/stats/rewrite")
+async def get_rewrite_stats(admin_user: User = Depends(get_admin_user)):
+    # Skip-rewrite gate hit rate and speculative retrieval reuse (this worker, since start)
+    return {
+        "gate": rewrite_gate.get_stats(),
+        "speculation": dict(rag_chain.speculation_stats),
+    }
+
+
+@router.get("/admin/stats/providers")
+async def get_provider_stats(admin_user: User = Depends(get_admin_user)):
+    # Query-embedding batch sizes and vector-query hedging (this worker, since start)
+    return providers.get_stats()
+
+
+@router.get("/admin/profiles")
+async def list_request_profiles(admin_user: User = Depends(get_admin_user)):
+    # Profiles captured via the X-Profile header or sampling (this worker's PROFILE_DIR)
+    return await run_in_threadpool(profiler.list_profiles)
+
+
+@router.get("/admin/profiles/{profile_id}/{kind}")
+async def download_request_profile(profile_id: str, kind: str, admin_user: User = Depends(get_admin_user)):
+    # kind: "speedscope" (open in https://speedscope.app) or "alloc" (tracemalloc report)
+    path = profiler.artifact_path(profile_id, kind)
+    if not path:
+        raise HTTPException(status_code=404, detail="Profile not found")
+    return FileResponse(path, filename=os.path.basename(path))
@@ -0,0 +1,248 @@
+# usage.py
+
+import os
+import atexit
+import threading
+from contextvars import ContextVar
+from datetime import datetime, timedelta
+from dotenv import load_dotenv
+from sqlmodel import Session, select, func
+
+from database import engine
+from models import TokenUsage
+
+load_dotenv()
+
+# ============================
+#  TOKEN + COST ACCOUNTING
+# ============================
+# call_openai_with_retry reports the `usage` of every completion here, tagged
+# with the code path that made it and the user of the current request.
+# Records are buffered in memory and written in batches by a background
+# thread, so the request path never waits on the database.
+
+USAGE_FLUSH_SECONDS = float(os.getenv("USAGE_FLUSH_SECONDS", "5"))
+USAGE_FLUSH_BATCH = int(os.getenv("USAGE_FLUSH_BATCH", "100"))
+USER_DAILY_TOKEN_BUDGET = int(os.getenv("USER_DAILY_TOKEN_BUDGET", "0")) # 0 = no budget
+USAGE_STATS_SAMPLE = int(os.getenv("USAGE_STATS_SAMPLE", "20000")) # Most recent calls used for percentiles
+
+# USD per 1K tokens: (prompt, completion)
+PRICES = {
+    "gpt-3.5-turbo": (0.0005, 0.0015),
+    "gpt-4o-mini": (0.00015, 0.0006),
+    "gpt-4o": (0.0025, 0.01),
+}
+
+# Set by /rag for the duration of a request (propagates into the threadpool)
+current_user_id: ContextVar = ContextVar("current_user_id", default=None)
+
+_buffer = []
+_buffer_lock = threading.Lock()
+_flush_event = threading.Event()
+_flusher = None
+_table_ready = False
+_table_lock = threading.Lock()
+
+# Today's token totals per user, for budget checks: {(day, user_id): tokens}
+_daily_tokens = {}
+
+
+def estimate_cost(model: str, prompt_tokens: int, completion_tokens: int):
+    prompt_price, completion_price = PRICES.get(model, PRICES["gpt-3.5-turbo"])
+    return (prompt_tokens * prompt_price + completion_tokens * completion_price) / 1000
+
+
+def record(path: str, model: str, usage: dict, latency_ms: float):
+    """Buffers one completion's usage. Cheap; safe to call on the request path."""
+    usage = usage or {}
+    prompt_tokens = usage.get("prompt_tokens") or 0
+    completion_tokens = usage.get("completion_tokens") or 0
+    now = datetime.utcnow()
+    user_id = current_user_id.get()
+
+    row = TokenUsage(
+        created_at=now,
+        day=now.strftime("%Y-%m-%d"),
+        user_id=user_id,
+        path=path,
+        model=model,
+        prompt_tokens=prompt_tokens,
+        completion_tokens=completion_tokens,
+        latency_ms=round(latency_ms, 1),
+        cost_usd=estimate_cost(model, prompt_tokens, completion_tokens),
+    )
+
+    with _buffer_lock:
+        _buffer.append(row)
+        key = (row.day, user_id)
+        if key in _daily_tokens:
+            _daily_tokens[key] += prompt_tokens + completion_tokens
+        full = len(_buffer) >= USAGE_FLUSH_BATCH
+
+    _ensure_flusher()
+    if full:
+        _flush_event.set()
+
+
+def flush():
+    """Writes buffered records in one transaction."""
+    with _buffer_lock:
+        rows = _buffer[:]
+        _buffer.clear()
+    if not rows:
+        return
+    try:
+        _ensure_table()
+        with Session(engine) as session:
+            session.add_all(rows)
+            session.commit()
+    except Exception as e:
+        print(f"Error flushing token usage ({len(rows)} records dropped): {e}")
+
+
+def _flush_loop():
+    while True:
+        _flush_event.wait(USAGE_FLUSH_SECONDS)
+        _flush_event.clear()
+        flush()
+
+
+def _ensure_table():
+    # Scripts (precompute.py, ...) don't run app startup, so nothing created the
+    # table for them. Runs in flush(), never inside a request's LLM call.
+    global _table_ready
+    with _table_lock:
+        if not _table_ready:
+            TokenUsage.__table__.create(engine, checkfirst=True)
+            _table_ready = True
+
+
+def _ensure_flusher():
+    global _flusher
+    if _flusher is None:
+        with _buffer_lock:
+            if _flusher is None:
+                _flusher = threading.Thread(target=_flush_loop, name="usage-flusher", daemon=True)
+                _flusher.start()
+                atexit.register(flush)
+
+
+# ============================
+#  BUDGETS
+# ============================
+
+def tokens_used_today(user_id: int):
+    day = datetime.utcnow().strftime("%Y-%m-%d")
+    key = (day, user_id)
+    with _buffer_lock:
+        if key in _daily_tokens:
+            return _daily_tokens[key]
+
+    # First check today in this worker: seed from the DB, plus anything still buffered
+    with Session(engine) as session:
+        statement = select(
+            func.coalesce(func.sum(TokenUsage.prompt_tokens + TokenUsage.completion_tokens), 0)
+        ).where(TokenUsage.day == day, TokenUsage.user_id == user_id)
+        stored = session.exec(statement).one()
+
+    with _buffer_lock:
+        # Earlier days are never checked again
+        for stale in [k for k in _daily_tokens if k[0] != day]:
+            del _daily_tokens[stale]
+        buffered = sum(r.prompt_tokens + r.completion_tokens for r in _buffer if r.day == day and r.user_id == user_id)
+        _daily_tokens.setdefault(key, stored + buffered)
+        return _daily_tokens[key]
+
+
+def over_budget(user_id: int):
+    if not USER_DAILY_TOKEN_BUDGET or user_id is None:
+        return False
+    return tokens_used_today(user_id) >= USER_DAILY_TOKEN_BUDGET
+
+
+# ============================
+#  STATS (admin endpoint)
+# ============================
+
+def _percentile(values, pct):
+    if not values:
+        return None
+    ordered = sorted(values)
+    k = min(len(ordered) - 1, max(0, int(round(pct / 100 * (len(ordered) - 1)))))
+    return ordered[k]
+
+
+_TOKENS = TokenUsage.prompt_tokens + TokenUsage.completion_tokens
+
+
+def _totals(session, since, key=None, limit=None):
+    """Calls, token and cost sums per `key` value (one row if key is None), in SQL."""
+    columns = [
+        func.count(TokenUsage.id),
+        func.coalesce(func.sum(TokenUsage.prompt_tokens), 0),
+        func.coalesce(func.sum(TokenUsage.completion_tokens), 0),
+        func.coalesce(func.sum(TokenUsage.cost_usd), 0.0),
+    ]
+    if key is None:
+        statement = select(*columns).where(TokenUsage.day >= since)
+        return {None: tuple(session.exec(statement).one())}
+
+    statement = select(key, *columns).where(TokenUsage.day >= since).group_by(key)
+    if limit:
+        statement = statement.order_by(func.sum(_TOKENS).desc()).limit(limit)
+    return {row[0]: tuple(row[1:]) for row in session.exec(statement).all()}
+
+
+def _summarize(totals, sample):
+    """`sample` is [(latency_ms, tokens)] for (some of) the same calls."""
+    calls, prompt_tokens, completion_tokens, cost_usd = totals
+    latencies = [latency for latency, _ in sample]
+    tokens = [n for _, n in sample]
+    return {
+        "calls": calls,
+        "prompt_tokens": prompt_tokens,
+        "completion_tokens": completion_tokens,
+        "cost_usd": round(cost_usd, 6),
+        "latency_ms": {p: _percentile(latencies, n) for p, n in (("p50", 50), ("p95", 95), ("p99", 99))},
+        "tokens_per_call": {p: _percentile(tokens, n) for p, n in (("p50", 50), ("p95", 95), ("p99", 99))},
+    }
+
+
+def get_stats(days: int = 1, top_users: int = 20):
+    """
+    Counts, tokens and cost are exact (GROUP BY in SQL). Percentiles come
+    from the latest USAGE_STATS_SAMPLE calls in the window, reading only
+    the columns they need.
+    """
+    flush()
+    since = (datetime.utcnow() - timedelta(days=days - 1)).strftime("%Y-%m-%d")
+    with Session(engine) as session:
+        total = _totals(session, since)[None]
+        by_path = _totals(session, since, TokenUsage.path)
+        by_day = _totals(session, since, TokenUsage.day)
+        by_user = _totals(session, since, TokenUsage.user_id, limit=top_users)
+        sample = session.exec(
+            select(TokenUsage.path, TokenUsage.day, TokenUsage.user_id, TokenUsage.latency_ms, _TOKENS)
+            .where(TokenUsage.day >= since)
+            .order_by(TokenUsage.id.desc())
+            .limit(USAGE_STATS_SAMPLE)
+        ).all()
+
+    samples = {}
+    for path, day, user_id, latency_ms, tokens in sample:
+        for group in (("path", path), ("day", day), ("user", user_id)):
+            samples.setdefault(group, []).append((latency_ms, tokens))
+
+    heaviest = sorted(by_user.items(), key=lambda item: -(item[1][1] + item[1][2]))
+    return {
+        "since": since,
+        "total": _summarize(total, [(r[3], r[4]) for r in sample]),
+        "by_path": {path: _summarize(t, samples.get(("path", path), [])) for path, t in sorted(by_path.items())},
+        "by_day": {day: _summarize(t, samples.get(("day", day), [])) for day, t in sorted(by_day.items())},
+        "by_user": {
+            str(user_id) if user_id is not None else "guest": _summarize(t, samples.get(("user", user_id), []))
+            for user_id, t in heaviest
+        },
+        "percentile_sample": len(sample),
+        "daily_token_budget": USER_DAILY_TOKEN_BUDGET or None,
+    }